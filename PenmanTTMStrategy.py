@@ -5,10 +5,13 @@ from sqlalchemy import text
 from dataclasses import dataclass
 from datetime import date
 from priceprovider import StooqPriceProvider, LocalStooqPriceProvider
-from events import MarketEvent, BuyEvent
+from events import MarketEvent, BuyEvent, EventBatch
 from strategy import Strategy
 from typing import List
 from store import ParquetRecordStore
+from fundamentals import PenmanTTMFundamentals
+from valuationcache import ValuationCache
+from profiling import timed
 
 # -----------------------------
 # Config
@@ -20,6 +23,216 @@ class PenmanConfig:
     margin_of_safety: float = 0.70  # buy if value >= price*(1+MOS)
     min_price: float = 0.01
 
+# time series of the valuations, partitioned by symbol
+VALUATIONS_DATASET = "valuations_penman_ttm"
+
+# -----------------------------
+# Statements (built once, executed on the strategy's per-run connection)
+# -----------------------------
+# Penman valuation of one symbol as-of a date; every query has period_end_date <= asof_date
+EQUITY_VAL_ASOF_SQL = text("""
+WITH params AS (
+    SELECT
+        CAST(:symbol AS text)  AS qfs_symbol,
+        CAST(:tax_rate AS float) AS tax_rate,
+        CAST(:wacc AS float)     AS wacc,
+        CAST(:asof AS date)      AS asof_date
+),
+
+-- TTM EBIT from last 4 quarters <= asof_date
+calc_vals AS (
+    SELECT SUM(operating_income) AS sustainable_ebit
+    FROM (
+        SELECT operating_income
+        FROM quickfs_dj_incomestatementquarter, params
+        WHERE qfs_symbol_id = params.qfs_symbol
+          AND period_end_date <= params.asof_date
+        ORDER BY period_end_date DESC
+        LIMIT 4
+    ) t
+    HAVING COUNT(*) = 4
+),
+
+-- Rank balance sheet quarters as-of date (latest first)
+bs_ranked AS (
+    SELECT
+        net_operating_assets,
+        total_equity,
+        period_end_date,
+        ROW_NUMBER() OVER (ORDER BY period_end_date DESC) AS rn
+    FROM quickfs_dj_balancesheetquarter, params
+    WHERE qfs_symbol_id = params.qfs_symbol
+      AND period_end_date <= params.asof_date
+),
+
+-- avg_noa from rn in (4, 8), b0 from rn=1 (as-of)
+noa_b0 AS (
+    SELECT
+        AVG(CASE WHEN rn IN (4, 8) THEN net_operating_assets END) AS avg_noa,
+        MAX(CASE WHEN rn = 1 THEN total_equity END) AS b0
+    FROM bs_ranked
+),
+
+-- Shares diluted from latest IS quarter <= asof_date
+shares AS (
+    SELECT shares_diluted
+    FROM quickfs_dj_incomestatementquarter, params
+    WHERE qfs_symbol_id = params.qfs_symbol
+      AND period_end_date <= params.asof_date
+    ORDER BY period_end_date DESC
+    LIMIT 1
+),
+
+equity_calc AS (
+    SELECT
+        b0
+        + ((sustainable_ebit * (1 - tax_rate) - wacc * avg_noa) / (1 + wacc))
+        + ((sustainable_ebit * (1 - tax_rate) - wacc * avg_noa) / ((1 + wacc) * wacc))
+        AS equity_val_total,
+
+        sustainable_ebit * (1 - tax_rate) - wacc * avg_noa AS residual_earnings,
+        sustainable_ebit * (1 - tax_rate) AS net_operating_profit,
+        avg_noa,
+        b0
+    FROM calc_vals, noa_b0, params
+),
+
+rnoa AS (
+    SELECT CASE WHEN avg_noa > 0 THEN net_operating_profit / avg_noa ELSE NULL END AS rnoa
+    FROM equity_calc
+)
+
+SELECT
+    CASE
+        WHEN (SELECT shares_diluted FROM shares) > 0
+        THEN ec.equity_val_total / (SELECT shares_diluted FROM shares)
+        ELSE NULL
+    END AS equity_val_per_share,
+
+    ec.equity_val_total,
+    (SELECT shares_diluted FROM shares) AS shares_diluted,
+    ec.residual_earnings,
+    r.rnoa,
+    ec.avg_noa,
+    ec.b0
+FROM equity_calc ec
+CROSS JOIN rnoa r;
+""")
+
+# period_end_dates of the last four IS quarters as-of a date
+LAST_4_DATES_SQL = text("""
+SELECT period_end_date
+FROM quickfs_dj_incomestatementquarter
+WHERE qfs_symbol_id = :symbol
+AND period_end_date <= :asof
+ORDER BY period_end_date DESC
+LIMIT 4;
+""")
+
+# set-based variant: valuation + last-4-quarters check of many (symbol, as-of date) pairs
+EQUITY_VAL_ASOF_MANY_SQL = text("""
+WITH params AS (
+    SELECT
+        CAST(:tax_rate AS float) AS tax_rate,
+        CAST(:wacc AS float)     AS wacc
+),
+
+req AS (
+    SELECT DISTINCT r.qfs_symbol, r.asof_date
+    FROM unnest(CAST(:symbols AS text[]), CAST(:asofs AS date[])) AS r(qfs_symbol, asof_date)
+),
+
+-- TTM EBIT and spacing check from last 4 IS quarters <= asof_date, per pair
+calc_vals AS (
+    SELECT
+        req.qfs_symbol,
+        req.asof_date,
+        SUM(t.operating_income ORDER BY t.period_end_date DESC) AS sustainable_ebit,
+        COUNT(*) AS n_quarters,
+        MAX(t.period_end_date) AS newest,
+        MIN(t.period_end_date) AS oldest
+    FROM req
+    CROSS JOIN LATERAL (
+        SELECT operating_income, period_end_date
+        FROM quickfs_dj_incomestatementquarter
+        WHERE qfs_symbol_id = req.qfs_symbol
+          AND period_end_date <= req.asof_date
+        ORDER BY period_end_date DESC
+        LIMIT 4
+    ) t
+    GROUP BY req.qfs_symbol, req.asof_date
+    HAVING COUNT(*) = 4
+),
+
+-- avg_noa from rn in (4, 8), b0 from rn=1, shares diluted from latest IS quarter (as-of)
+inputs AS (
+    SELECT
+        cv.qfs_symbol,
+        cv.asof_date,
+        cv.sustainable_ebit,
+        (EXTRACT(YEAR FROM cv.newest) - EXTRACT(YEAR FROM cv.oldest)) <= 1 AS valid_last4,
+        nb.avg_noa,
+        nb.b0,
+        sh.shares_diluted
+    FROM calc_vals cv
+    CROSS JOIN LATERAL (
+        SELECT
+            AVG(CASE WHEN rn IN (4, 8) THEN net_operating_assets END) AS avg_noa,
+            MAX(CASE WHEN rn = 1 THEN total_equity END) AS b0
+        FROM (
+            SELECT
+                net_operating_assets,
+                total_equity,
+                ROW_NUMBER() OVER (ORDER BY period_end_date DESC) AS rn
+            FROM quickfs_dj_balancesheetquarter
+            WHERE qfs_symbol_id = cv.qfs_symbol
+              AND period_end_date <= cv.asof_date
+            ORDER BY period_end_date DESC
+            LIMIT 8
+        ) bs_ranked
+    ) nb
+    LEFT JOIN LATERAL (
+        SELECT shares_diluted
+        FROM quickfs_dj_incomestatementquarter
+        WHERE qfs_symbol_id = cv.qfs_symbol
+          AND period_end_date <= cv.asof_date
+        ORDER BY period_end_date DESC
+        LIMIT 1
+    ) sh ON TRUE
+),
+
+equity_calc AS (
+    SELECT
+        i.*,
+        b0
+        + ((sustainable_ebit * (1 - tax_rate) - wacc * avg_noa) / (1 + wacc))
+        + ((sustainable_ebit * (1 - tax_rate) - wacc * avg_noa) / ((1 + wacc) * wacc))
+        AS equity_val_total,
+
+        sustainable_ebit * (1 - tax_rate) - wacc * avg_noa AS residual_earnings,
+        sustainable_ebit * (1 - tax_rate) AS net_operating_profit
+    FROM inputs i, params
+)
+
+SELECT
+    ec.qfs_symbol,
+    ec.asof_date,
+    ec.valid_last4,
+    CASE
+        WHEN ec.shares_diluted > 0
+        THEN ec.equity_val_total / ec.shares_diluted
+        ELSE NULL
+    END AS equity_val_per_share,
+
+    ec.equity_val_total,
+    ec.shares_diluted,
+    ec.residual_earnings,
+    CASE WHEN ec.avg_noa > 0 THEN ec.net_operating_profit / ec.avg_noa ELSE NULL END AS rnoa,
+    ec.avg_noa,
+    ec.b0
+FROM equity_calc ec;
+""")
+
 # -----------------------------
 # Strategy: Penman TTM as-of date
 # -----------------------------
@@ -29,133 +242,83 @@ class PenmanTTMAsOfStrategy(Strategy):
     - event.period_end_date is a month bucket (01-MM-YYYY)
     - we convert it to the last available trading day in that month (via Stooq)
     - all fundamentals queries are anchored to <= asof_date (no look-ahead)
+    - optionally, fundamentals are served from a PenmanTTMFundamentals preload instead of
+      two SQL round-trips per event (results are identical)
+    - optionally, valuations are looked up in a persistent ValuationCache first; a hit skips
+      both queries
     """
 
-    def __init__(self, engine, cfg: PenmanConfig, price_provider: LocalStooqPriceProvider, store: ParquetRecordStore):
+    def __init__(self, engine, cfg: PenmanConfig, price_provider: LocalStooqPriceProvider, store: ParquetRecordStore,
+                 fundamentals: PenmanTTMFundamentals | None = None, cache: ValuationCache | None = None):
         super().__init__(engine)
         self.cfg = cfg
         self.prices = price_provider
         self.store = store
+        self.fundamentals = fundamentals
+        self.cache = cache
+
+    def on_start(self, symbols: List[str]) -> None:
+        #download price histories of the whole universe up front if the provider supports it
+        if hasattr(self.prices, "prefetch"):
+            self.prices.prefetch(symbols)
+
+    def begin_period(self, events: EventBatch) -> None:
+        super().begin_period(events)
+        #a due flush of the valuation store happens between periods
+        self.store.at_boundary()
+        #the previous period is complete: one cache commit per period
+        if self.cache is not None:
+            self.cache.commit()
+
+    def on_finish(self) -> None:
+        if self.cache is not None:
+            print(self.cache.report())
+            self.cache.close()
+        super().on_finish()
 
+    def checkpoint_state(self, force: bool = False) -> dict | None:
+        #valuations are the only side effect besides the buys; a checkpoint is only taken once the
+        #store has flushed on its own, forcing it here would write one small file per symbol
+        if force:
+            self.store.flush()
+        elif not self.store.at_boundary():
+            return None
+        return {"store": self.store.checkpoint()}
+
+    def restore_state(self, state: dict) -> None:
+        removed = self.store.rollback(state["store"])
+        print(f"Removed {removed} valuation part files written after the checkpoint")
+
+    def reset_state(self) -> None:
+        self.store.rotate(VALUATIONS_DATASET)
+
+    @timed("penman.equity_val_penman_ttm_asof")
     def equity_val_penman_ttm_asof(self, symbol: str, asof_date: date):
         """
         Mirrors your original function but makes it "as-of": every query has period_end_date <= asof_date.
         Returns a dict-like row or None.
         """
-        sql = text("""
-        WITH params AS (
-            SELECT
-                CAST(:symbol AS text)  AS qfs_symbol,
-                CAST(:tax_rate AS float) AS tax_rate,
-                CAST(:wacc AS float)     AS wacc,
-                CAST(:asof AS date)      AS asof_date
-        ),
-
-        -- TTM EBIT from last 4 quarters <= asof_date
-        calc_vals AS (
-            SELECT SUM(operating_income) AS sustainable_ebit
-            FROM (
-                SELECT operating_income
-                FROM quickfs_dj_incomestatementquarter, params
-                WHERE qfs_symbol_id = params.qfs_symbol
-                  AND period_end_date <= params.asof_date
-                ORDER BY period_end_date DESC
-                LIMIT 4
-            ) t
-            HAVING COUNT(*) = 4
-        ),
-
-        -- Rank balance sheet quarters as-of date (latest first)
-        bs_ranked AS (
-            SELECT
-                net_operating_assets,
-                total_equity,
-                period_end_date,
-                ROW_NUMBER() OVER (ORDER BY period_end_date DESC) AS rn
-            FROM quickfs_dj_balancesheetquarter, params
-            WHERE qfs_symbol_id = params.qfs_symbol
-              AND period_end_date <= params.asof_date
-        ),
-
-        -- avg_noa from rn in (4, 8), b0 from rn=1 (as-of)
-        noa_b0 AS (
-            SELECT
-                AVG(CASE WHEN rn IN (4, 8) THEN net_operating_assets END) AS avg_noa,
-                MAX(CASE WHEN rn = 1 THEN total_equity END) AS b0
-            FROM bs_ranked
-        ),
-
-        -- Shares diluted from latest IS quarter <= asof_date
-        shares AS (
-            SELECT shares_diluted
-            FROM quickfs_dj_incomestatementquarter, params
-            WHERE qfs_symbol_id = params.qfs_symbol
-              AND period_end_date <= params.asof_date
-            ORDER BY period_end_date DESC
-            LIMIT 1
-        ),
-
-        equity_calc AS (
-            SELECT
-                b0
-                + ((sustainable_ebit * (1 - tax_rate) - wacc * avg_noa) / (1 + wacc))
-                + ((sustainable_ebit * (1 - tax_rate) - wacc * avg_noa) / ((1 + wacc) * wacc))
-                AS equity_val_total,
-
-                sustainable_ebit * (1 - tax_rate) - wacc * avg_noa AS residual_earnings,
-                sustainable_ebit * (1 - tax_rate) AS net_operating_profit,
-                avg_noa,
-                b0
-            FROM calc_vals, noa_b0, params
-        ),
-
-        rnoa AS (
-            SELECT CASE WHEN avg_noa > 0 THEN net_operating_profit / avg_noa ELSE NULL END AS rnoa
-            FROM equity_calc
-        )
+        if self.fundamentals is not None:
+            return self.fundamentals.equity_val_penman_ttm_asof(symbol, asof_date, tax_rate=self.cfg.tax_rate, wacc=self.cfg.wacc)
 
-        SELECT
-            CASE
-                WHEN (SELECT shares_diluted FROM shares) > 0
-                THEN ec.equity_val_total / (SELECT shares_diluted FROM shares)
-                ELSE NULL
-            END AS equity_val_per_share,
-
-            ec.equity_val_total,
-            (SELECT shares_diluted FROM shares) AS shares_diluted,
-            ec.residual_earnings,
-            r.rnoa,
-            ec.avg_noa,
-            ec.b0
-        FROM equity_calc ec
-        CROSS JOIN rnoa r;
-        """)
-
-        with self.engine.connect() as conn:
-            row = conn.execute(sql, {
-                "symbol": symbol,
-                "tax_rate": self.cfg.tax_rate,
-                "wacc": self.cfg.wacc,
-                "asof": asof_date,
-            }).mappings().first()
+        row = self.db.connection().execute(EQUITY_VAL_ASOF_SQL, {
+            "symbol": symbol,
+            "tax_rate": self.cfg.tax_rate,
+            "wacc": self.cfg.wacc,
+            "asof": asof_date,
+        }).mappings().first()
 
         return row  # dict-like mapping or None
 
+    @timed("penman.has_valid_last4_quarters")
     def has_valid_last4_quarters(self, symbol: str, asof: date) -> bool:
         """
         Function that checks if the last four entries are actually four quarters apart. For some companies, mainly on OTC, they are not required to file quarterly, so the last four entries in quarterly tables can be spaced 4 years apart and not 12 months
         """
-        last_4_dates_sql = text("""
-        SELECT period_end_date
-        FROM quickfs_dj_incomestatementquarter
-        WHERE qfs_symbol_id = :symbol
-        AND period_end_date <= :asof
-        ORDER BY period_end_date DESC
-        LIMIT 4;
-        """)
+        if self.fundamentals is not None:
+            return self.fundamentals.has_valid_last4_quarters(symbol, asof)
 
-        with self.engine.connect() as conn:
-            dates: List[date] = conn.execute(last_4_dates_sql, {"symbol": symbol, "asof": asof}).scalars().all()
+        dates: List[date] = self.db.connection().execute(LAST_4_DATES_SQL, {"symbol": symbol, "asof": asof}).scalars().all()
 
         #if there are less than four data points available, skip
         if len(dates) != 4:
@@ -167,27 +330,122 @@ class PenmanTTMAsOfStrategy(Strategy):
 
         return (newest.year - oldest.year) <= 1
 
+    @timed("penman.equity_val_penman_ttm_asof_many")
+    def equity_val_penman_ttm_asof_many(self, symbols: List[str], asof_dates: List[date]) -> dict:
+        """
+        Set-based variant of equity_val_penman_ttm_asof + has_valid_last4_quarters.
+        Takes parallel arrays of symbols and as-of dates and resolves all pairs in one statement
+        (LATERAL joins, one plan). Returns {(symbol, asof_date): row}; the row carries an extra
+        "valid_last4" flag. Pairs with fewer than 4 IS quarters are absent, like the single-pair query.
+        """
+        rows = self.db.connection().execute(EQUITY_VAL_ASOF_MANY_SQL, {
+            "symbols": list(symbols),
+            "asofs": list(asof_dates),
+            "tax_rate": self.cfg.tax_rate,
+            "wacc": self.cfg.wacc,
+        }).mappings().all()
+
+        return {(row["qfs_symbol"], row["asof_date"]): row for row in rows}
+
     def on_market(self, event: MarketEvent) -> BuyEvent | None:
         asof_date, close = self.prices.last_close_in_month(event.symbol, event.period_end_date)
         if close is None or close < self.cfg.min_price:
             return None
         
-        #check if last four data points are valid to compute the penman equity val
-        if not self.has_valid_last4_quarters(event.symbol, asof_date):
-            return None
-
-        # Compute Penman valuation anchored to asof_date (no look-ahead)
-        res = self.equity_val_penman_ttm_asof(event.symbol, asof_date)
+        res = self.valuation(event.symbol, asof_date)
         if not res:
             return None
 
+        return self._evaluate(event, asof_date, close, res)
+
+    def valuation(self, symbol: str, asof_date: date):
+        """
+        Valuation row as-of asof_date, or None if the last four quarters are not valid or there is
+        no row. Served from the valuation cache when one is configured.
+        """
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(symbol, asof_date, self.cfg)
+            found, res = self.cache.get(key)
+            if found:
+                return res
+
+        res = None
+        #check if last four data points are valid to compute the penman equity val
+        if self.has_valid_last4_quarters(symbol, asof_date):
+            # Compute Penman valuation anchored to asof_date (no look-ahead)
+            res = self.equity_val_penman_ttm_asof(symbol, asof_date)
+
+        if key is not None:
+            self.cache.put(key, res)
+        return res
+
+    def on_market_batch(self, events: EventBatch | List[MarketEvent]) -> List[BuyEvent]:
+        """
+        Resolves the whole cross-section with one set-based valuation query.
+        With preloaded fundamentals there is nothing to batch, so it falls back to on_market.
+        """
+        if self.fundamentals is not None:
+            return super().on_market_batch(events)
+
+        priced = []
+        for event in events:
+            asof_date, close = self.prices.last_close_in_month(event.symbol, event.period_end_date)
+            if close is None or close < self.cfg.min_price:
+                continue
+            priced.append((event, asof_date, close))
+
+        if not priced:
+            return []
+
+        # valuation per priced event; cache hits are filled in here, misses resolved in one query below
+        results = [None] * len(priced)
+        keys = [None] * len(priced)
+        missing = []
+        for i, (event, asof_date, _) in enumerate(priced):
+            if self.cache is not None:
+                keys[i] = self.cache.key(event.symbol, asof_date, self.cfg)
+                found, results[i] = self.cache.get(keys[i])
+                if found:
+                    continue
+            missing.append(i)
+
+        if missing:
+            rows = self.equity_val_penman_ttm_asof_many(
+                [priced[i][0].symbol for i in missing],
+                [priced[i][1] for i in missing],
+            )
+            for i in missing:
+                event, asof_date, _ = priced[i]
+                res = rows.get((event.symbol, asof_date))
+                if res is not None and not res["valid_last4"]:
+                    res = None
+                results[i] = res
+
+                if keys[i] is not None:
+                    self.cache.put(keys[i], res)
+
+        buys = []
+        for (event, asof_date, close), res in zip(priced, results):
+            if not res:
+                continue
+
+            buy = self._evaluate(event, asof_date, close, res)
+            if buy is not None:
+                buys.append(buy)
+        return buys
+
+    def _evaluate(self, event: MarketEvent, asof_date: date, close: float, res) -> BuyEvent | None:
+        """
+        Stores the valuation and applies the buy rule for one (symbol, asof_date) valuation row.
+        """
         value = res.get("equity_val_per_share")
         if value is None or value <= 0:
             return None
         
         #store result of penman computation as a time series
         self.store.append(
-            dataset="valuations_penman_ttm",
+            dataset=VALUATIONS_DATASET,
             record={
                 "symbol": event.symbol,
                 "asof_date": asof_date.isoformat(),
@@ -1,39 +1,42 @@
 from events import MarketEvent, BuyEvent
-from sqlalchemy import text
+from sqlalchemy.engine import Engine
 from strategy import Strategy
 
 class SimpleFundamentalStrategy(Strategy):
-    def fetch_balance_sheet(self, symbol, period_end_date):
-        sql = text("""
+    """
+    Lookups go through the strategy's DataAccess: per period, each of the three statements
+    runs once for all symbols of the period instead of once per event.
+    """
+
+    def __init__(self, engine: Engine):
+        super().__init__(engine)
+
+        self.db.register("balance_sheet", """
             SELECT *
             FROM balance_sheet
-            WHERE symbol = :symbol AND period_end_date = :ped
-            LIMIT 1
+            WHERE symbol = ANY(:symbols) AND period_end_date = :ped
         """)
-        with self.engine.connect() as conn:
-            return conn.execute(sql, {"symbol": symbol, "ped": period_end_date}).mappings().first()
-
-    def fetch_income_statement(self, symbol, period_end_date):
-        sql = text("""
+        self.db.register("income_statement", """
             SELECT *
             FROM income_statement
-            WHERE symbol = :symbol AND period_end_date = :ped
-            LIMIT 1
+            WHERE symbol = ANY(:symbols) AND period_end_date = :ped
         """)
-        with self.engine.connect() as conn:
-            return conn.execute(sql, {"symbol": symbol, "ped": period_end_date}).mappings().first()
-
-    def fetch_close_price(self, symbol, period_end_date):
         # Optional
-        sql = text("""
-            SELECT close
+        self.db.register("daily_close", """
+            SELECT symbol, close
             FROM daily_close
-            WHERE symbol = :symbol AND date = :d
-            LIMIT 1
+            WHERE symbol = ANY(:symbols) AND date = :d
         """)
-        with self.engine.connect() as conn:
-            row = conn.execute(sql, {"symbol": symbol, "d": period_end_date}).first()
-            return None if row is None else row[0]
+
+    def fetch_balance_sheet(self, symbol, period_end_date):
+        return self.db.load("balance_sheet", symbol, ped=period_end_date)
+
+    def fetch_income_statement(self, symbol, period_end_date):
+        return self.db.load("income_statement", symbol, ped=period_end_date)
+
+    def fetch_close_price(self, symbol, period_end_date):
+        row = self.db.load("daily_close", symbol, d=period_end_date)
+        return None if row is None else row["close"]
 
     def should_buy(self, bs, is_):
         # Placeholder logic – replace with your real buy rule
@@ -63,6 +66,11 @@ class SimpleFundamentalStrategy(Strategy):
         return BuyEvent(
             symbol=event.symbol,
             period_end_date=event.period_end_date,
-            price=price,
+            close_price=price,
+            intrinsic_value=None,
+            bps=None,
+            rnoa=None,
+            mos=None,
+            nr_shares=None,
             reason=reason,
-        )
\ No newline at end of file
+        )
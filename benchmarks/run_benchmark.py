@@ -0,0 +1,117 @@
+"""
+End-to-end benchmark of BacktestEngine + PenmanTTMAsOfStrategy on synthetic data.
+
+The synthetic data is generated in the parent; only the backtest of every scale runs in a fresh
+(spawned) process, so peak RSS is measured per scale and not inflated by the generator. Fundamentals
+are served from the PenmanTTMFundamentals preload and prices from the memory-mapped store; the
+per-event SQL path of the strategy is Postgres only, point --db-url at a Postgres database to
+generate into it instead of the default SQLite file.
+
+Usage:
+  python -m benchmarks.run_benchmark --symbols 1000 10000 100000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from sqlalchemy import create_engine, text
+
+from benchmarks.synthetic import generate
+from engine import BacktestEngine
+from fundamentals import PenmanTTMFundamentals
+from PenmanTTMStrategy import PenmanConfig, PenmanTTMAsOfStrategy
+from priceprovider import MmapStooqPriceProvider
+from profiling import INSTRUMENTS
+from sink import BufferedCsvBuyWriter
+from store import BufferedParquetRecordStore
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_scale(n_symbols: int, params: dict, batched: bool = False) -> dict:
+    """
+    Runs one backtest over the n_symbols synthetic symbols described by params (see generate)
+    and returns its measurements.
+    """
+    engine = create_engine(params["db_url"], future=True)
+
+    with engine.connect() as conn:
+        n_events = conn.execute(text("SELECT COUNT(*) FROM quickfs_dj_balancesheetquarter")).scalar_one()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        #the final flush of the store happens on leaving the with block, so it is timed too
+        t0 = time.perf_counter()
+        with BufferedParquetRecordStore(root_dir=tmp) as store:
+            #not loaded here: the preload happens lazily inside the run, so it is part of the timings
+            fundamentals = PenmanTTMFundamentals(engine, None)
+            strategy = PenmanTTMAsOfStrategy(
+                engine, PenmanConfig(),
+                price_provider=MmapStooqPriceProvider(Path(params["price_store"])),
+                store=store,
+                fundamentals=fundamentals,
+            )
+
+            bt = BacktestEngine(
+                db_url=params["db_url"],
+                symbols=None,
+                out_csv=None,
+                strategy=strategy,
+                batched=batched,
+                writer=BufferedCsvBuyWriter(str(Path(tmp) / "buys.csv")),
+                instrument=True,
+            )
+
+            bt.run()
+        wall_s = time.perf_counter() - t0
+
+    return {
+        "symbols": n_symbols,
+        "events": n_events,
+        "batched": batched,
+        "wall_s": wall_s,
+        "events_per_s": n_events / wall_s if wall_s > 0 else 0.0,
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": INSTRUMENTS.summary(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the backtest on synthetic data")
+    parser.add_argument("--symbols", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    parser.add_argument("--data-dir", default="data/bench", help="generated data is cached here per scale")
+    parser.add_argument("--db-url", default=None, help="defaults to one SQLite file per scale")
+    parser.add_argument("--batched", action="store_true", help="dispatch whole cross-sections")
+    parser.add_argument("--out", default="output/benchmarks/results.json")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.symbols:
+        params = generate(Path(args.data_dir) / str(n), n, db_url=args.db_url)
+        # a fresh process per scale keeps the peak RSS of the scales apart
+        with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+            results.append(pool.submit(run_scale, n, params, args.batched).result())
+
+    print(f"\n{'symbols':>10} {'events':>12} {'wall s':>10} {'events/s':>12} {'peak RSS MB':>12}")
+    for r in results:
+        print(f"{r['symbols']:>10} {r['events']:>12} {r['wall_s']:>10.2f} {r['events_per_s']:>12.0f} {r['peak_rss_mb']:>12.1f}")
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(f"results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
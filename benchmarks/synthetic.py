@@ -0,0 +1,166 @@
+"""
+Synthetic stand-ins for the backtest inputs, so the engine can be benchmarked offline:
+
+  quickfs_dj_incomestatementquarter   -> any SQLAlchemy URL (a SQLite file by default)
+  quickfs_dj_balancesheetquarter      -> same database
+  month-end closes                    -> memory-mapped price store read by MmapStooqPriceProvider
+
+Symbols are named SYM000001:US, SYM000002:US, ... Listings start at different quarters and a
+share of the symbols skip a year of filings, so the last-4-quarters check rejects some events.
+
+Usage:
+  python -m benchmarks.synthetic --symbols 1000 --out data/bench/1000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Date, Float, String, create_engine, text
+
+from stooqstore import write_stooq_store
+
+FIRST_MONTH = np.datetime64("2010-01", "M")
+GAP_SHARE = 0.05         # share of symbols with a missing year of filings
+NULL_EBIT_SHARE = 0.02   # share of IS rows with a NULL operating_income
+GENERATOR_VERSION = 1
+
+
+def symbol_names(n_symbols: int) -> list[str]:
+    return [f"SYM{i:06d}:US" for i in range(1, n_symbols + 1)]
+
+
+def quarter_frames(n_symbols: int, n_quarters: int = 40, seed: int = 0) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Income statement and balance sheet quarters of n_symbols, ordered by symbol and date.
+    period_end_date is a month bucket (first day of the month) like in the quickfs tables.
+    """
+    rng = np.random.default_rng(seed)
+    symbols = np.array(symbol_names(n_symbols), dtype=object)
+
+    sym_idx = np.repeat(np.arange(n_symbols), n_quarters)
+    q = np.tile(np.arange(n_quarters), n_symbols)
+
+    #listing quarter of every symbol, and an optional 4 quarter gap
+    listed_at = rng.integers(0, max(n_quarters // 4, 1), n_symbols)
+    has_gap = rng.random(n_symbols) < GAP_SHARE
+    gap_at = rng.integers(0, max(n_quarters - 4, 1), n_symbols)
+
+    keep = q >= listed_at[sym_idx]
+    keep &= ~(has_gap[sym_idx] & (q >= gap_at[sym_idx]) & (q < gap_at[sym_idx] + 4))
+    sym_idx, q = sym_idx[keep], q[keep]
+    n = len(q)
+
+    #size of every company, the line items are drawn around it
+    scale = rng.lognormal(mean=18, sigma=1.5, size=n_symbols)[sym_idx]
+
+    operating_income = scale * rng.normal(0.05, 0.04, n)
+    operating_income[rng.random(n) < NULL_EBIT_SHARE] = np.nan
+    net_operating_assets = scale * rng.uniform(0.5, 3.0, n)
+
+    dates = pd.Series((FIRST_MONTH + 3 * q).astype("datetime64[D]")).dt.date
+
+    is_df = pd.DataFrame({
+        "qfs_symbol_id": symbols[sym_idx],
+        "period_end_date": dates,
+        "operating_income": operating_income,
+        "shares_diluted": scale / rng.uniform(5, 50, n_symbols)[sym_idx],
+    })
+    bs_df = pd.DataFrame({
+        "qfs_symbol_id": symbols[sym_idx],
+        "period_end_date": dates,
+        "net_operating_assets": net_operating_assets,
+        "total_equity": net_operating_assets * rng.uniform(0.4, 1.2, n),
+    })
+    return is_df, bs_df
+
+
+def write_fundamentals(db_url: str, is_df: pd.DataFrame, bs_df: pd.DataFrame, chunksize: int = 50_000) -> None:
+    """
+    (Re)creates both quarter tables with the indexes the backtest queries rely on.
+    """
+    engine = create_engine(db_url, future=True)
+
+    tables = {
+        "quickfs_dj_incomestatementquarter": (is_df, {"operating_income": Float(), "shares_diluted": Float()}),
+        "quickfs_dj_balancesheetquarter": (bs_df, {"net_operating_assets": Float(), "total_equity": Float()}),
+    }
+
+    with engine.begin() as conn:
+        for table, (df, dtypes) in tables.items():
+            df.to_sql(table, conn, if_exists="replace", index=False, chunksize=chunksize,
+                      dtype={"qfs_symbol_id": String(), "period_end_date": Date(), **dtypes})
+            conn.execute(text(f"CREATE INDEX ix_{table}_symbol_date ON {table} (qfs_symbol_id, period_end_date)"))
+
+        #the event stream is ordered by date first
+        conn.execute(text(
+            "CREATE INDEX ix_quickfs_dj_balancesheetquarter_date_symbol "
+            "ON quickfs_dj_balancesheetquarter (period_end_date, qfs_symbol_id)"
+        ))
+
+    print(f"✔ Wrote {len(is_df)} IS rows / {len(bs_df)} BS rows to {db_url}")
+
+
+def price_histories(n_symbols: int, n_months: int, seed: int = 0):
+    """
+    One close per month (on the last business day) for every symbol, as a geometric random walk.
+    Yields (stooq name, country, dates, closes) rows for write_stooq_store.
+    """
+    rng = np.random.default_rng(seed + 1)
+
+    months = FIRST_MONTH + np.arange(n_months)
+    month_ends = (months + 1).astype("datetime64[D]") - 1
+    dates = np.busday_offset(month_ends, 0, roll="backward")
+
+    for symbol in symbol_names(n_symbols):
+        base, country = symbol.lower().split(":")
+        closes = rng.uniform(1, 100) * np.exp(np.cumsum(rng.normal(0.005, 0.08, n_months)))
+        yield f"{base}.{country}", country, dates, closes
+
+
+def generate(out_dir: Path, n_symbols: int, n_quarters: int = 40, seed: int = 0, db_url: str | None = None) -> dict:
+    """
+    Generates the database and price store of one benchmark scale into out_dir, unless a
+    previous run with the same parameters already did. Returns the generation parameters.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    if db_url is None:
+        db_url = f"sqlite:///{(out_dir / 'quickfs.sqlite').resolve()}"
+
+    params = {
+        "version": GENERATOR_VERSION,
+        "symbols": n_symbols,
+        "quarters": n_quarters,
+        "seed": seed,
+        "db_url": db_url,
+        "price_store": str(out_dir / "prices"),
+    }
+
+    marker = out_dir / "generated.json"
+    if marker.exists() and json.loads(marker.read_text(encoding="utf-8")) == params:
+        return params
+
+    is_df, bs_df = quarter_frames(n_symbols, n_quarters, seed)
+    write_fundamentals(db_url, is_df, bs_df)
+    # prices cover the quarters plus the month the last quarter ends in
+    write_stooq_store(out_dir / "prices", price_histories(n_symbols, 3 * n_quarters + 3, seed), ["us"])
+
+    marker.write_text(json.dumps(params), encoding="utf-8")
+    return params
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic quickfs tables and prices for benchmarks")
+    parser.add_argument("--symbols", type=int, default=1000)
+    parser.add_argument("--quarters", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, default=Path("data/bench"))
+    parser.add_argument("--db-url", default=None, help="defaults to a SQLite file in --out")
+    args = parser.parse_args()
+
+    generate(args.out, args.symbols, args.quarters, args.seed, args.db_url)
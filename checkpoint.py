@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from datetime import date
+from pathlib import Path
+
+CHECKPOINT_VERSION = 1
+
+
+def run_key(symbols: list[str] | None, start: date | None, end: date | None) -> dict:
+    """
+    Identifies the run a checkpoint belongs to; resuming a different universe or date range is refused.
+    """
+    digest = None if symbols is None else hashlib.md5("\n".join(sorted(symbols)).encode("utf-8")).hexdigest()
+    return {
+        "symbols": digest,
+        "start": None if start is None else start.isoformat(),
+        "end": None if end is None else end.isoformat(),
+    }
+
+
+class Checkpoint:
+    """
+    Progress of a backtest run as a small JSON file:
+
+      {"version": 1, "run": {...}, "period": "2015-03-01", "finished": false,
+       "sink": {...}, "strategy": {...}}
+
+    period is the last fully processed period_end_date (None before the first one), sink and
+    strategy hold the markers their rollback()/restore_state() need to drop later writes.
+    Every save replaces the file atomically, so a crash never leaves a torn checkpoint.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+
+    def load(self) -> dict | None:
+        if not self.path.exists():
+            return None
+
+        with self.path.open("r", encoding="utf-8") as f:
+            state = json.load(f)
+
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version in {self.path}: {state.get('version')}")
+        return state
+
+    def save(self, state: dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump({"version": CHECKPOINT_VERSION, **state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
@@ -1,24 +1,66 @@
-from sqlalchemy import create_engine, text
+from datetime import date
+from itertools import groupby
+
+from sqlalchemy import Date, String, create_engine, text
+
+from events import EventBatch
 
 
 class PostgresDataHandler:
     """
     Responsibility: yield (symbol, period_end_date) in ascending order.
+
+    Rows are streamed through a server-side cursor chunk_size rows at a time, so the first
+    event arrives immediately and memory stays flat regardless of the universe size.
+    Optional start/end bounds (inclusive) are applied in SQL. symbols=None streams every symbol.
+    after (exclusive) skips periods that are already done, e.g. when resuming from a checkpoint.
     """
 
-    def __init__(self, db_url: str, symbols: list[str]):
+    def __init__(self, db_url: str, symbols: list[str] | None, chunk_size: int = 10_000, start: date | None = None, end: date | None = None,
+                 after: date | None = None):
         self.engine = create_engine(db_url, future=True)
         self.symbols = symbols
+        self.chunk_size = chunk_size
+        self.start = start
+        self.end = end
+        self.after = after
 
     def stream(self):
-        sql = text("""
+        conditions = ["TRUE"]
+        params = {}
+
+        if self.symbols is not None:
+            conditions.append("qfs_symbol_id = ANY(:symbols)")
+            params["symbols"] = self.symbols
+
+        if self.start is not None:
+            conditions.append("period_end_date >= :start")
+            params["start"] = self.start
+        if self.end is not None:
+            conditions.append("period_end_date <= :end")
+            params["end"] = self.end
+        if self.after is not None:
+            conditions.append("period_end_date > :after")
+            params["after"] = self.after
+
+        sql = text(f"""
             SELECT qfs_symbol_id, period_end_date
             FROM quickfs_dj_balancesheetquarter
-            WHERE qfs_symbol_id = ANY(:symbols)
+            WHERE {" AND ".join(conditions)}
             ORDER BY period_end_date ASC, qfs_symbol_id ASC
-        """)
+        """).columns(qfs_symbol_id=String, period_end_date=Date)  # typed, so drivers returning text dates yield dates too
 
         with self.engine.connect() as conn:
-            result = conn.execute(sql, {"symbols": self.symbols})
+            # named (server-side) cursor with psycopg2, fetched chunk_size rows at a time
+            result = conn.execution_options(stream_results=True, max_row_buffer=self.chunk_size).execute(sql, params)
             for row in result:
-                yield row.qfs_symbol_id, row.period_end_date
\ No newline at end of file
+                yield row.qfs_symbol_id, row.period_end_date
+
+    def stream_batches(self):
+        """
+        Yields one columnar EventBatch per period_end_date (the stream is ordered by it).
+        Symbols within a period are in codepoint order (sorted()), independent of the database
+        collation, so serial, parallel and incremental runs produce their output in one order.
+        """
+        for ped, rows in groupby(self.stream(), key=lambda row: row[1]):
+            yield EventBatch.from_market(sorted(symbol for symbol, _ in rows), ped)
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from profiling import timed
+
+
+class DataAccess:
+    """
+    Per-run data access for strategies, in the style of a DataLoader.
+
+    - one connection (autocommit, so no transaction stays open for hours) for the whole run
+    - statements are registered once by name and reused for every lookup
+    - lookups are per symbol, but resolved per period: the first lookup of a shape (statement
+      name + parameters other than the symbol) fetches every symbol of the current period in
+      one `= ANY(:symbols)` query, the following lookups of that shape are served from memory
+
+    The engine announces the symbols of every period through Strategy.begin_period. A lookup of
+    a symbol outside the announced set is fetched on its own.
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self._conn: Connection | None = None
+        self._statements: dict[str, tuple] = {}                 # name -> (statement, symbol column)
+        self._period_symbols: list[str] = []
+        self._cache: dict[tuple, dict[str, object]] = {}        # shape -> symbol -> row or None
+
+        self.lookups = 0
+        self.queries = 0
+
+    def register(self, name: str, sql: str, symbol_col: str = "symbol") -> None:
+        """
+        sql must select the rows of many symbols, filtered with `<symbol_col> = ANY(:symbols)`,
+        and return symbol_col. It may use further named parameters, passed to load().
+        """
+        self._statements[name] = (text(sql), symbol_col)
+
+    def connection(self) -> Connection:
+        if self._conn is None or self._conn.closed:
+            self._conn = self.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        return self._conn
+
+    def begin_period(self, symbols: list[str]) -> None:
+        # rows of the previous period are not needed anymore
+        self._period_symbols = list(symbols)
+        self._cache = {}
+
+    def load(self, name: str, symbol: str, **params):
+        """
+        First row of statement name for symbol (dict-like mapping), or None.
+        """
+        self.lookups += 1
+        shape = (name, tuple(sorted(params.items())))
+        rows = self._cache.setdefault(shape, {})
+
+        if symbol not in rows:
+            pending = [s for s in self._period_symbols if s not in rows]
+            if symbol not in set(pending):
+                pending.append(symbol)
+            self._fetch(name, rows, pending, params)
+
+        return rows[symbol]
+
+    @timed("dataaccess.fetch")
+    def _fetch(self, name: str, rows: dict, symbols: list[str], params: dict) -> None:
+        stmt, symbol_col = self._statements[name]
+        self.queries += 1
+
+        fetched = {}
+        for row in self.connection().execute(stmt, {"symbols": symbols, **params}).mappings():
+            # keep the first row per symbol, like LIMIT 1 on a single-symbol query
+            fetched.setdefault(row[symbol_col], row)
+
+        for s in symbols:
+            rows[s] = fetched.get(s)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -1,30 +1,186 @@
+import cProfile
+import pstats
 import queue
+import time
+from datetime import date
 
-from events import MarketEvent, BuyEvent
+from checkpoint import Checkpoint, run_key
+from events import MarketEvent, BuyEvent, EventBatch
 from data import PostgresDataHandler
 from sink import CsvBuyWriter
 from strategy import Strategy
+from profiling import INSTRUMENTS
 
 
 class BacktestEngine:
-    def __init__(self, db_url: str, symbols: list[str], out_csv: str, strategy: Strategy):
+    def __init__(self, db_url: str, symbols: list[str] | None, out_csv: str | None, strategy: Strategy, batched: bool = False, writer=None,
+                 start: date | None = None, end: date | None = None, instrument: bool = False, cprofile_path: str | None = None,
+                 checkpoint_path: str | None = None, resume: bool = False, checkpoint_interval: float = 60.0,
+                 data: PostgresDataHandler | None = None):
         self.events = queue.Queue()
 
-        self.data = PostgresDataHandler(db_url=db_url, symbols=symbols)
-        self.writer = CsvBuyWriter(out_csv)
+        # optional inclusive period_end_date bounds, pushed into the SQL; a prepared handler
+        # (e.g. incremental.IncrementalDataHandler) can be injected instead
+        self.data = data if data is not None else PostgresDataHandler(db_url=db_url, symbols=symbols, start=start, end=end)
+        # any sink with write/flush/close; defaults to the unbuffered csv writer
+        self.writer = writer if writer is not None else CsvBuyWriter(out_csv)
         self.strategy = strategy  # injected
+        self.batched = batched    # dispatch one cross-section (period_end_date) at a time
+        self.period = None        # period_end_date currently being processed
+        self.instrument = instrument          # per-stage timing report at the end of the run
+        self.cprofile_path = cprofile_path    # dump cProfile stats of the event loop here
+
+        # progress is checkpointed at period boundaries, at most every checkpoint_interval seconds;
+        # resume=True continues after the last checkpointed period and drops the writes made after it
+        self.checkpoint = Checkpoint(checkpoint_path) if checkpoint_path else None
+        self.resume = resume
+        self.checkpoint_interval = checkpoint_interval
+        self._run_key = run_key(symbols, start, end)
+        self._last_checkpoint = 0.0
+
+    def _save_checkpoint(self, finished: bool = False, force: bool = False):
+        with INSTRUMENTS.stage("engine.checkpoint"):
+            # the strategy may not be at a cheap consistent point (e.g. buffered valuations); retry next period
+            strategy = self.strategy.checkpoint_state(force=force or finished)
+            if strategy is None:
+                return
+            # then the sink: it flushes, so every buy of the completed periods is on disk
+            sink = self.writer.checkpoint()
+            self.checkpoint.save({
+                "run": self._run_key,
+                "period": None if self.period is None else self.period.isoformat(),
+                "finished": finished,
+                "sink": sink,
+                "strategy": strategy,
+            })
+        self._last_checkpoint = time.monotonic()
+
+    def _period_done(self):
+        """
+        Called whenever self.period has been fully processed.
+        """
+        if self.checkpoint is not None and time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+            self._save_checkpoint()
+
+    def _restore(self) -> bool:
+        """
+        Loads the checkpoint (if resuming) and rolls sink and strategy back to it, or writes
+        the initial checkpoint. Returns True if the checkpointed run had already finished.
+        """
+        state = self.checkpoint.load() if self.resume else None
+        if state is None:
+            # a fresh run must not append to the output of a previous one
+            self.writer.rotate()
+            self.strategy.reset_state()
+            # a crash before the first periodic checkpoint rolls back to here
+            self._save_checkpoint(force=True)
+            return False
+
+        if state["run"] != self._run_key:
+            raise ValueError(f"Checkpoint {self.checkpoint.path} belongs to a different run (symbols/start/end)")
+
+        self.writer.rollback(state["sink"])
+        self.strategy.restore_state(state["strategy"])
+
+        if state["period"] is not None:
+            self.period = date.fromisoformat(state["period"])
+            self.data.after = self.period
+
+        print(f"Resuming from checkpoint {self.checkpoint.path}: last completed period {state['period']}")
+        return state["finished"]
 
     def run(self):
-        for symbol, ped in self.data.stream():
-            self.events.put(MarketEvent(symbol=symbol, period_end_date=ped))
+        if self.instrument:
+            INSTRUMENTS.reset()
+            INSTRUMENTS.enable()
+
+        profiler = cProfile.Profile() if self.cprofile_path else None
+        try:
+            finished = False
+            if self.checkpoint is not None:
+                finished = self._restore()
+
+            if finished:
+                print("Checkpointed run already finished, nothing to do")
+                return
+
+            with INSTRUMENTS.stage("engine.on_start"):
+                self.strategy.on_start(self.data.symbols)
+
+            if profiler is not None:
+                profiler.enable()
+
+            if self.batched:
+                self.run_batched()
+            else:
+                self.run_events()
+
+            if self.checkpoint is not None:
+                self._save_checkpoint(finished=True)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+
+            with INSTRUMENTS.stage("engine.on_finish"):
+                self.strategy.on_finish()
+
+            # flush buffered sinks at shutdown
+            with INSTRUMENTS.stage("sink.close"):
+                self.writer.close()
+
+            if profiler is not None:
+                profiler.dump_stats(self.cprofile_path)
+                print(f"cProfile stats written to {self.cprofile_path}")
+                pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+            if self.instrument:
+                INSTRUMENTS.disable()
+                print(INSTRUMENTS.report())
+
+    def run_events(self):
+        """
+        Dispatches events one at a time through the queue. Rows are read one period at a time,
+        so the strategy learns the period's symbols (begin_period) before its first event.
+        """
+        for batch in INSTRUMENTS.iter("data.stream_batches", self.data.stream_batches()):
+            self.period = batch.period_end_dates[0].item()
+            self.strategy.begin_period(batch)
+
+            for event in batch:
+                self.events.put(event)
+
+                while not self.events.empty():
+                    ev = self.events.get()
+
+                    if isinstance(ev, MarketEvent):
+                        with INSTRUMENTS.stage("strategy.on_market"):
+                            buy = self.strategy.on_market(ev)
+                        if buy is not None:
+                            self.events.put(buy)
+
+                    elif isinstance(ev, BuyEvent):
+                        with INSTRUMENTS.stage("sink.write"):
+                            self.writer.write(ev)
+
+            self._period_done()
+
+    def run_batched(self):
+        """
+        Hands every cross-section (one period_end_date) to strategy.on_market_batch in one call,
+        as a columnar EventBatch. The strategy may answer with a list of BuyEvents or an EventBatch.
+        """
+        for batch in INSTRUMENTS.iter("data.stream_batches", self.data.stream_batches()):
+            self.period = batch.period_end_dates[0].item()
+            self.strategy.begin_period(batch)
 
-            while not self.events.empty():
-                ev = self.events.get()
+            with INSTRUMENTS.stage("strategy.on_market_batch"):
+                buys = self.strategy.on_market_batch(batch)
 
-                if isinstance(ev, MarketEvent):
-                    buy = self.strategy.on_market(ev)
-                    if buy is not None:
-                        self.events.put(buy)
+            with INSTRUMENTS.stage("sink.write"):
+                if isinstance(buys, EventBatch):
+                    self.writer.write_batch(buys)
+                else:
+                    for buy in buys:
+                        self.writer.write(buy)
 
-                elif isinstance(ev, BuyEvent):
-                    self.writer.write(ev)
\ No newline at end of file
+            self._period_done()
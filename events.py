@@ -1,15 +1,19 @@
+from __future__ import annotations
+
 from dataclasses import dataclass
 from datetime import date
-from typing import Optional
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class MarketEvent:
     symbol: str
     period_end_date: date
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class BuyEvent:
     symbol: str
     period_end_date: date
@@ -19,4 +23,96 @@ class BuyEvent:
     rnoa: Optional[float]
     mos: Optional[float] #margin of safety
     nr_shares: Optional[float]
-    reason: str = ""
\ No newline at end of file
+    reason: str = ""
+
+
+# numeric BuyEvent fields carried as float columns (NaN for None)
+BUY_VALUE_FIELDS = ("close_price", "intrinsic_value", "bps", "rnoa", "mos", "nr_shares")
+
+
+class EventBatch:
+    """
+    Columnar batch of events backed by NumPy arrays, passed around without one object per event.
+
+      symbols           vocabulary of symbol strings
+      symbol_ids        int32 index into symbols, one per event
+      period_end_dates  datetime64[D], one per event
+      values            optional float64 columns (e.g. the BuyEvent fields, NaN for None)
+      reasons           optional list of strings (BuyEvent.reason)
+
+    Iterating a batch yields MarketEvents, so per-event code keeps working on it.
+    """
+
+    __slots__ = ("symbols", "symbol_ids", "period_end_dates", "values", "reasons")
+
+    def __init__(
+        self,
+        symbols: Sequence[str],
+        symbol_ids: np.ndarray,
+        period_end_dates: np.ndarray,
+        values: dict[str, np.ndarray] | None = None,
+        reasons: list[str] | None = None,
+    ):
+        self.symbols = tuple(symbols)
+        self.symbol_ids = np.asarray(symbol_ids, dtype=np.int32)
+        self.period_end_dates = np.asarray(period_end_dates, dtype="datetime64[D]")
+        self.values = values or {}
+        self.reasons = reasons
+
+    @classmethod
+    def from_market(cls, symbols: Sequence[str], period_end_date: date) -> "EventBatch":
+        """
+        One cross-section: all symbols share the same period_end_date.
+        """
+        n = len(symbols)
+        return cls(symbols, np.arange(n, dtype=np.int32), np.full(n, np.datetime64(period_end_date, "D")))
+
+    @classmethod
+    def from_buys(cls, buys: Sequence[BuyEvent]) -> "EventBatch":
+        vocab: dict[str, int] = {}
+        ids = np.fromiter((vocab.setdefault(b.symbol, len(vocab)) for b in buys), dtype=np.int32, count=len(buys))
+        dates = np.array([b.period_end_date for b in buys], dtype="datetime64[D]")
+        values = {
+            name: np.array([np.nan if getattr(b, name) is None else getattr(b, name) for b in buys], dtype=np.float64)
+            for name in BUY_VALUE_FIELDS
+        }
+        return cls(list(vocab), ids, dates, values=values, reasons=[b.reason for b in buys])
+
+    @classmethod
+    def concat(cls, batches: Sequence["EventBatch"]) -> "EventBatch":
+        vocab: dict[str, int] = {}
+        ids, dates, reasons = [], [], []
+        names = batches[0].values.keys() if batches else ()
+        for b in batches:
+            remap = np.array([vocab.setdefault(s, len(vocab)) for s in b.symbols], dtype=np.int32)
+            ids.append(remap[b.symbol_ids] if len(remap) else b.symbol_ids)
+            dates.append(b.period_end_dates)
+            reasons.extend(b.reasons or [""] * len(b))
+        values = {name: np.concatenate([b.values[name] for b in batches]) for name in names}
+        return cls(
+            list(vocab),
+            np.concatenate(ids) if ids else np.zeros(0, dtype=np.int32),
+            np.concatenate(dates) if dates else np.zeros(0, dtype="datetime64[D]"),
+            values=values,
+            reasons=reasons,
+        )
+
+    def __len__(self) -> int:
+        return len(self.symbol_ids)
+
+    def symbol_column(self) -> np.ndarray:
+        """
+        Symbol string per event (object array).
+        """
+        return np.asarray(self.symbols, dtype=object)[self.symbol_ids] if self.symbols else np.zeros(0, dtype=object)
+
+    def __iter__(self) -> Iterator[MarketEvent]:
+        for symbol_id, ped in zip(self.symbol_ids.tolist(), self.period_end_dates.tolist()):
+            yield MarketEvent(symbol=self.symbols[symbol_id], period_end_date=ped)
+
+    def buy_events(self) -> Iterator[BuyEvent]:
+        columns = [self.values[name].tolist() for name in BUY_VALUE_FIELDS]
+        reasons = self.reasons or [""] * len(self)
+        for i, (symbol_id, ped) in enumerate(zip(self.symbol_ids.tolist(), self.period_end_dates.tolist())):
+            fields = [None if v != v else v for v in (col[i] for col in columns)]  # NaN -> None
+            yield BuyEvent(self.symbols[symbol_id], ped, *fields, reason=reasons[i])
@@ -1,111 +1,185 @@
+import hashlib
+import json
 import os
-import requests
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
 import pandas as pd
 import psycopg2
 from dotenv import load_dotenv
+from openpyxl import load_workbook
+
 from helpers import parse_ticker, SUFFIX_TO_EXCHANGES
-import time
+from httpclient import build_session
 
+SHEET_ID = "1nj8BFXnedgQ2hugQL4YQ5QSwBhIiztBS358cu7zUWM4"
+EXPORT_URL = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/export?format=xlsx"
 
+INPUT_EXCEL = "google_sheet.xlsx"
 
-def extractTickers():
-    # ===============================
-    # 0. Define which columns you want to export; by default we export original ticket (as in MCC sheet, db_ticker, qfs_symbol, company_name, exchange, last close price, equity value penman, margin of safety penman)
-    # ===============================
-    OPTIONAL_COLUMNS = {
-        "Popular": "Popular",
-        "REV YoY": "REV YoY",
-        "MKT CAP": "MKT CAP",
-        "OPmargin": "OPmargin",
-        "STOCK PRICE": "STOCK PRICE"
-    }
-
-    #normalize keys (lower case and strip white spaces)
-    # normalize keys in-place
-    OPTIONAL_COLUMNS = {k.lower().strip(): v for k, v in OPTIONAL_COLUMNS.items()}
+# validators of the last download, content hash and the resolved qfs symbols
+UNIVERSE_STATE = Path("output/universe_state.json")
 
-    # ===============================
-    # 0. Load environment (dev)
-    # ===============================
+# within this age the sheet is not even re-checked
+UNIVERSE_MAX_AGE = timedelta(hours=1)
 
-    # expects DB_* vars in .env or .env.dev
-    load_dotenv()
+# Define which columns you want to export; by default we export original ticket (as in MCC sheet, db_ticker, qfs_symbol, company_name, exchange, last close price, equity value penman, margin of safety penman)
+OPTIONAL_COLUMNS = {
+    "Popular": "Popular",
+    "REV YoY": "REV YoY",
+    "MKT CAP": "MKT CAP",
+    "OPmargin": "OPmargin",
+    "STOCK PRICE": "STOCK PRICE"
+}
 
-    # ===============================
-    # 1. Download Google Sheet
-    # ===============================
+#normalize keys (lower case and strip white spaces)
+OPTIONAL_COLUMNS = {k.lower().strip(): v for k, v in OPTIONAL_COLUMNS.items()}
+
+
+def _load_state() -> dict:
+    if not UNIVERSE_STATE.exists():
+        return {}
+    with UNIVERSE_STATE.open("r", encoding="utf-8") as f:
+        return json.load(f)
 
-    SHEET_ID = "1nj8BFXnedgQ2hugQL4YQ5QSwBhIiztBS358cu7zUWM4"
-    EXPORT_URL = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/export?format=xlsx"
 
-    INPUT_EXCEL = "google_sheet.xlsx"
+def _save_state(state: dict) -> None:
+    UNIVERSE_STATE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = UNIVERSE_STATE.with_name(UNIVERSE_STATE.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, UNIVERSE_STATE)
 
-    response = requests.get(EXPORT_URL)
+
+def download_sheet(state: dict) -> tuple[bytes | None, dict]:
+    """
+    Conditional GET of the sheet export against the validators in state.
+    Returns (content, validators); content is None if the local copy is still current (304).
+    """
+    headers = {}
+    if Path(INPUT_EXCEL).exists():
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+
+    response = build_session(pool_size=1).get(EXPORT_URL, headers=headers, timeout=60)
+    if response.status_code == 304:
+        return None, {"etag": state.get("etag"), "last_modified": state.get("last_modified")}
     response.raise_for_status()
 
-    with open(INPUT_EXCEL, "wb") as f:
-        f.write(response.content)
+    tmp = Path(INPUT_EXCEL + ".tmp")
+    tmp.write_bytes(response.content)
+    os.replace(tmp, INPUT_EXCEL)
 
-    print("✔ Google Sheet downloaded")
+    return response.content, {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
 
-    # ===============================
-    # 2. Load all sheets & extract tickers
-    # ===============================
 
-    xls = pd.ExcelFile(INPUT_EXCEL)
+def read_sheet_tickers(path: str) -> tuple[set[str], dict[str, dict]]:
+    """
+    Tickers (stripped, upper case) of every sheet with a ticker column, and the optional
+    columns per raw ticker (first non-null value wins across sheets).
+    Read-only openpyxl pass that only materializes the ticker and optional columns.
+    """
+    wb = load_workbook(path, read_only=True, data_only=True)
 
     raw_tickers: set[str] = set()
     ticker_metadata: dict[str, dict] = {} #store additional info like revenue growth, market cap etc.
 
-    #iterate through different sheets of microcap club
-    for sheet_name in xls.sheet_names:
-        df = pd.read_excel(xls, sheet_name=sheet_name)
+    try:
+        #iterate through different sheets of microcap club
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None) or ()
+            columns = {str(c).lower().strip(): i for i, c in reversed(list(enumerate(header))) if c is not None}
+
+            if "ticker" not in columns:
+                print(f"⚠ Sheet '{ws.title}' skipped (no ticker column)")
+                continue
+
+            ticker_idx = columns["ticker"]
+            # determine which optional columns exist on this sheet
+            optional = [(col, columns[col]) for col in OPTIONAL_COLUMNS if col in columns]
+
+            # only the cell range spanning the needed columns is read
+            needed = [ticker_idx] + [i for _, i in optional]
+            lo, hi = min(needed), max(needed)
+
+            for row in ws.iter_rows(min_row=2, min_col=lo + 1, max_col=hi + 1, values_only=True):
+                ticker = row[ticker_idx - lo] if ticker_idx - lo < len(row) else None
+                if ticker is None or (isinstance(ticker, float) and ticker != ticker):
+                    continue
 
-        df.columns = df.columns.str.lower().str.strip()
+                #insert all tickers into set
+                raw_tickers.add(str(ticker).strip().upper())
 
-        if "ticker" not in df.columns:
-            print(f"⚠ Sheet '{sheet_name}' skipped (no ticker column)")
-            continue
+                # merge into metadata dict (first value wins across sheets)
+                meta = ticker_metadata.setdefault(ticker, {})
+                for col_key, i in optional:
+                    value = row[i - lo] if i - lo < len(row) else None
+                    if col_key not in meta and value is not None:
+                        meta[col_key] = value
+    finally:
+        wb.close()
 
-        tickers = (
-            df["ticker"]
-            .dropna()
-            .astype(str)
-            .str.strip()
-            .str.upper()
-        )
+    return raw_tickers, ticker_metadata
 
-        #insert all tickers into set
-        raw_tickers.update(tickers)
 
-        # determine which optional columns exist on this sheet
-        existing_optional_cols = [
-            col for col in OPTIONAL_COLUMNS.keys()
-            if col in df.columns
-        ]
+def extractTickers(force: bool = False, max_age: timedelta = UNIVERSE_MAX_AGE):
+    """
+    qfs symbols of the universe in the Google Sheet.
+
+    The resolved list is persisted with the sheet's HTTP validators and content hash:
+      - checked less than max_age ago: returned without any request
+      - 304 Not Modified or identical content: returned without parsing and DB matching
+    force=True always downloads, parses and resolves.
+    """
+    # ===============================
+    # 0. Load environment (dev)
+    # ===============================
+
+    # expects DB_* vars in .env or .env.dev
+    load_dotenv()
+
+    state = {} if force else _load_state()
+    now = datetime.now(timezone.utc)
+
+    if "qfs_symbols" in state and Path(INPUT_EXCEL).exists():
+        checked_at = datetime.fromisoformat(state["checked_at"])
+        if now - checked_at < max_age:
+            print(f"✔ Universe checked at {state['checked_at']}, using {len(state['qfs_symbols'])} cached qfs symbols")
+            return state["qfs_symbols"]
+
+    # ===============================
+    # 1. Download Google Sheet (conditional)
+    # ===============================
 
-        if not existing_optional_cols:
-            continue
+    content, validators = download_sheet(state)
+    digest = state.get("sha256") if content is None else hashlib.sha256(content).hexdigest()
 
+    if "qfs_symbols" in state and digest == state.get("sha256"):
+        state.update(validators, checked_at=now.isoformat())
+        _save_state(state)
+        print(f"✔ Google Sheet unchanged, using {len(state['qfs_symbols'])} cached qfs symbols")
+        return state["qfs_symbols"]
 
-        # keep only ticker + optional columns, take first non-null per ticker
-        subset = (
-            df[["ticker"] + existing_optional_cols]
-            .groupby("ticker", as_index=False)
-            .first()
-        )
+    print("✔ Google Sheet downloaded")
 
-        # merge into metadata dict (first value wins across sheets)
-        for _, row in subset.iterrows():
-            ticker_metadata.setdefault(row["ticker"], {})
+    # ===============================
+    # 2. Load all sheets & extract tickers
+    # ===============================
 
-            for col_key in existing_optional_cols:
-                #display_name = OPTIONAL_COLUMNS[col_key]
-                if col_key not in ticker_metadata[row["ticker"]]:
-                    ticker_metadata[row["ticker"]][col_key] = row[col_key]
+    raw_tickers, ticker_metadata = read_sheet_tickers(INPUT_EXCEL)
 
     print(f"✔ Collected {len(raw_tickers)} unique tickers")
 
+    qfs_symbols = resolve_qfs_symbols(raw_tickers)
+
+    _save_state({**validators, "sha256": digest, "checked_at": now.isoformat(), "qfs_symbols": qfs_symbols})
+    return qfs_symbols
+
+
+def resolve_qfs_symbols(raw_tickers: set[str]) -> list[str]:
     # ===============================
     # 3. Ticker normalization
     # ===============================
@@ -158,57 +232,75 @@ def extractTickers():
     # ===============================
     # 5. Resolve matches per original ticker
     # ===============================
-    found_rows = []
-    missing_rows = []
-    iterator = 0
-
-    qfs_symbols = []
-
-    for original_ticker, meta in ticker_meta.items():
-        #extract symbol and suffix; symbol: ZEN, suffix: V (ZEN.V)
-        symbol = meta["symbol"]
-        suffix = meta["suffix"]
-        variants = meta["variants"]
-
-        #get candidates. We can have multiple entries with the same ticker, like SPN --> then we need to match based on suffix/exchange
-        candidates = db_df[
-            db_df["db_ticker"].isin(variants) | db_df["db_qfs_symbol"].isin(variants)
-        ]
-
-        if candidates.empty:
-            missing_rows.append({
-                "original_ticker": original_ticker,
-                "tried_variants": ", ".join(variants),
-            })
-            continue
-
-        #exchnage based resolution
-        if suffix and suffix in SUFFIX_TO_EXCHANGES:
-            expected_exchanges = SUFFIX_TO_EXCHANGES[suffix]
-            exchange_matches = candidates[candidates["exchange"].isin(expected_exchanges)]
-
-            if len(exchange_matches) == 1:
-                match = exchange_matches.iloc[0]
-            else:
-                match = candidates.iloc[0]  # fallback
-                print('ambibgious match for: ', match["db_qfs_symbol"])
-        #case when ticker has not suffix
-        else:
-            # 2️⃣ Unique ticker fallback
-            if len(candidates) == 1:
-                match = candidates.iloc[0]
-            else:
-                expected_exchanges = SUFFIX_TO_EXCHANGES[""]
-                exchange_matches = candidates[candidates["exchange"].isin(expected_exchanges)]
-                #no suffix can be NYSE, NASDAQ, OTC
-                if len(exchange_matches) == 1:
-                    match = exchange_matches.iloc[0]
-                else:
-                    match = candidates.iloc[0]  # fallback
-                    print('ambibgious match for: ', match["db_qfs_symbol"])
-
-        # match = matches.iloc[0]
-        qfs_symbols.append(match["db_qfs_symbol"])
-        #qfs_symbol = match["db_qfs_symbol"]
-    
-    return qfs_symbols
\ No newline at end of file
+
+    return match_tickers(ticker_meta, db_df)
+
+
+def match_tickers(ticker_meta: dict[str, dict], db_df: pd.DataFrame) -> list[str]:
+    """
+    Picks one traded-companies row per original ticker with one join pipeline instead of a
+    DataFrame filter per ticker. Rules (unchanged):
+      - candidates: rows whose ticker or qfs_symbol is one of the ticker's variants, in DB row order
+      - the expected exchanges come from the suffix, or from SUFFIX_TO_EXCHANGES[""] if the
+        ticker has no (known) suffix
+      - exactly one candidate on an expected exchange wins, otherwise the first candidate;
+        that fallback is reported as ambiguous, except for a single candidate of a ticker
+        without a known suffix
+    Returns the qfs symbols in ticker_meta order; tickers without candidates are reported as missing.
+    """
+    tickers = pd.DataFrame({
+        "original_ticker": list(ticker_meta),
+        "order": range(len(ticker_meta)),
+        "suffix": [meta["suffix"] for meta in ticker_meta.values()],
+        "variant": [list(meta["variants"]) for meta in ticker_meta.values()],
+    })
+    tickers["known_suffix"] = tickers["suffix"].map(lambda s: bool(s) and s in SUFFIX_TO_EXCHANGES)
+    tickers["exchange_key"] = tickers["suffix"].where(tickers["known_suffix"], "")
+
+    variants = tickers[["original_ticker", "variant"]].explode("variant")
+    db = db_df.reset_index(drop=True).rename_axis("row_id").reset_index()
+
+    #a row can match through its ticker or its qfs_symbol; it is one candidate either way
+    candidates = pd.concat([
+        variants.merge(db, left_on="variant", right_on="db_ticker"),
+        variants.merge(db, left_on="variant", right_on="db_qfs_symbol"),
+    ]).drop_duplicates(["original_ticker", "row_id"])
+
+    candidates = candidates.merge(tickers[["original_ticker", "order", "exchange_key", "known_suffix"]], on="original_ticker")
+
+    #rank: rows on one of the expected exchanges of the suffix
+    expected = pd.DataFrame(
+        [(key, exchange) for key, exchanges in SUFFIX_TO_EXCHANGES.items() for exchange in exchanges],
+        columns=["exchange_key", "exchange"],
+    ).drop_duplicates()
+    candidates = candidates.merge(expected.assign(on_expected=True), on=["exchange_key", "exchange"], how="left")
+    candidates["on_expected"] = candidates["on_expected"].notna()
+    candidates = candidates.sort_values(["order", "row_id"], kind="mergesort")
+
+    #first candidate (DB row order) and the first one on an expected exchange, per ticker
+    first = candidates.drop_duplicates("order").set_index("order").sort_index()
+    first_expected = candidates[candidates["on_expected"]].drop_duplicates("order").set_index("order")
+
+    per_ticker = first[["original_ticker", "known_suffix"]].copy()
+    per_ticker["first_symbol"] = first["db_qfs_symbol"]
+    per_ticker["expected_symbol"] = first_expected["db_qfs_symbol"].reindex(per_ticker.index)
+    per_ticker["n_candidates"] = candidates.groupby("order").size().reindex(per_ticker.index)
+    per_ticker["n_expected"] = candidates.groupby("order")["on_expected"].sum().reindex(per_ticker.index)
+
+    unique_expected = per_ticker["n_expected"] == 1
+    per_ticker["match"] = per_ticker["expected_symbol"].where(unique_expected, per_ticker["first_symbol"])
+    per_ticker["ambiguous"] = ~unique_expected & (per_ticker["known_suffix"] | (per_ticker["n_candidates"] != 1))
+
+    for symbol in per_ticker.loc[per_ticker["ambiguous"], "match"]:
+        print('ambibgious match for: ', symbol)
+
+    found = set(per_ticker["original_ticker"])
+    missing_rows = [
+        {"original_ticker": original_ticker, "tried_variants": ", ".join(meta["variants"])}
+        for original_ticker, meta in ticker_meta.items()
+        if original_ticker not in found
+    ]
+    if missing_rows:
+        print(f"⚠ {len(missing_rows)} tickers without a DB match")
+
+    return per_ticker["match"].tolist()
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from profiling import timed
+
+
+def penman_value(sustainable_ebit, avg_noa, b0, shares_diluted, tax_rate, wacc) -> dict:
+    """
+    Closed-form Penman valuation with the same arithmetic as the SQL CTE in PenmanTTMAsOfStrategy.
+    Works on scalars and on (broadcastable) NumPy arrays; NaN plays the role of SQL NULL.
+    """
+    sustainable_ebit, avg_noa, b0, shares_diluted, tax_rate, wacc = (
+        np.asarray(x, dtype=float) for x in (sustainable_ebit, avg_noa, b0, shares_diluted, tax_rate, wacc)
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        net_operating_profit = sustainable_ebit * (1 - tax_rate)
+        residual_earnings = sustainable_ebit * (1 - tax_rate) - wacc * avg_noa
+        equity_val_total = (
+            b0
+            + (residual_earnings / (1 + wacc))
+            + (residual_earnings / ((1 + wacc) * wacc))
+        )
+        rnoa = np.where(avg_noa > 0, net_operating_profit / avg_noa, np.nan)
+        equity_val_per_share = np.where(shares_diluted > 0, equity_val_total / shares_diluted, np.nan)
+
+    return {
+        "equity_val_per_share": equity_val_per_share,
+        "equity_val_total": equity_val_total,
+        "residual_earnings": residual_earnings,
+        "rnoa": rnoa,
+    }
+
+
+def _nullable(x) -> float | None:
+    x = float(x)
+    return None if np.isnan(x) else x
+
+
+class PenmanTTMFundamentals:
+    """
+    In-memory replacement for the two per-event Penman queries of PenmanTTMAsOfStrategy.
+
+    Loads quickfs_dj_incomestatementquarter and quickfs_dj_balancesheetquarter for the whole
+    universe once and precomputes, for every quarter row, the values the SQL path would see if
+    that row was the latest one <= asof_date:
+      - TTM EBIT (sum of the last 4 operating_income, NULLs skipped, requires 4 rows)
+      - the last-4-quarters spacing check
+      - diluted shares of the latest IS quarter
+      - avg NOA of balance sheet rows rn=4 and rn=8, b0 = total_equity of rn=1
+
+    A lookup is then a searchsorted on the symbol's quarter dates.
+    """
+
+    IS_SQL = """
+        SELECT qfs_symbol_id, period_end_date, operating_income, shares_diluted
+        FROM quickfs_dj_incomestatementquarter
+        {where}
+        ORDER BY qfs_symbol_id ASC, period_end_date ASC
+    """
+
+    BS_SQL = """
+        SELECT qfs_symbol_id, period_end_date, net_operating_assets, total_equity
+        FROM quickfs_dj_balancesheetquarter
+        {where}
+        ORDER BY qfs_symbol_id ASC, period_end_date ASC
+    """
+
+    def __init__(self, engine: Engine, symbols: list[str] | None):
+        self.engine = engine
+        self.symbols = symbols
+
+        self._is: dict[str, np.ndarray] = {}
+        self._bs: dict[str, np.ndarray] = {}
+        self._is_slices: dict[str, tuple[int, int]] = {}   # symbol -> (start, end) into IS arrays
+        self._bs_slices: dict[str, tuple[int, int]] = {}   # symbol -> (start, end) into BS arrays
+        self.loaded = False
+
+    # ---------- loading ----------
+    def _read(self, sql: str) -> pd.DataFrame:
+        # symbols=None loads every symbol in the tables
+        if self.symbols is None:
+            query, params = text(sql.format(where="")), {}
+        else:
+            query, params = text(sql.format(where="WHERE qfs_symbol_id = ANY(:symbols)")), {"symbols": list(self.symbols)}
+
+        with self.engine.connect() as conn:
+            df = pd.read_sql(query, conn, params=params)
+
+        df["period_end_date"] = pd.to_datetime(df["period_end_date"])
+        # stable sort so that equal dates keep the order the database returned them in
+        return df.sort_values(["qfs_symbol_id", "period_end_date"], kind="mergesort").reset_index(drop=True)
+
+    @staticmethod
+    def _slices(symbol_col: pd.Series) -> tuple[dict[str, tuple[int, int]], np.ndarray]:
+        """
+        Returns symbol -> (start, end) offsets and the position of every row within its symbol.
+        """
+        symbols = symbol_col.to_numpy()
+        n = len(symbols)
+        if n == 0:
+            return {}, np.zeros(0, dtype=np.int64)
+
+        starts = np.flatnonzero(np.r_[True, symbols[1:] != symbols[:-1]])
+        ends = np.r_[starts[1:], n]
+        pos = np.arange(n) - np.repeat(starts, ends - starts)
+
+        slices = {symbols[s]: (int(s), int(e)) for s, e in zip(starts, ends)}
+        return slices, pos
+
+    @staticmethod
+    def _lag(values: np.ndarray, pos: np.ndarray, k: int) -> np.ndarray:
+        """
+        values[i - k] within the same symbol, NaN where the symbol has fewer than k+1 rows.
+        """
+        out = np.full(len(values), np.nan)
+        if k < len(values):
+            out[k:] = values[:len(values) - k]
+        out[pos < k] = np.nan
+        return out
+
+    @timed("fundamentals.load")
+    def load(self) -> "PenmanTTMFundamentals":
+        is_df = self._read(self.IS_SQL)
+        bs_df = self._read(self.BS_SQL)
+
+        # ----- income statement -----
+        self._is_slices, is_pos = self._slices(is_df["qfs_symbol_id"])
+        is_dates = is_df["period_end_date"].to_numpy().astype("datetime64[D]")
+        op = is_df["operating_income"].astype(float).to_numpy()
+
+        # SUM() over the last 4 rows, newest first, NULLs skipped; all NULL -> NULL
+        ttm_ebit = np.zeros(len(op))
+        any_value = np.zeros(len(op), dtype=bool)
+        for k in range(4):
+            lagged = self._lag(op, is_pos, k)
+            has = ~np.isnan(lagged)
+            ttm_ebit = ttm_ebit + np.where(has, lagged, 0.0)
+            any_value |= has
+        ttm_ebit[~any_value] = np.nan
+
+        # HAVING COUNT(*) = 4
+        has_4 = is_pos >= 3
+
+        # newest.year - oldest.year <= 1 over the last 4 IS rows
+        years = is_dates.astype("datetime64[Y]").astype(np.int64)
+        oldest_year = self._lag(years.astype(float), is_pos, 3)
+        valid_last4 = has_4 & ((years - oldest_year) <= 1)
+
+        self._is = {
+            "dates": is_dates,
+            "has_4": has_4,
+            "valid_last4": valid_last4,
+            "sustainable_ebit": ttm_ebit,
+            "shares_diluted": is_df["shares_diluted"].astype(float).to_numpy(),
+        }
+
+        # ----- balance sheet -----
+        self._bs_slices, bs_pos = self._slices(bs_df["qfs_symbol_id"])
+        noa = bs_df["net_operating_assets"].astype(float).to_numpy()
+
+        # AVG() over rn in (4, 8), NULLs skipped; rn=4 is 3 rows back, rn=8 is 7 rows back
+        noa_4 = self._lag(noa, bs_pos, 3)
+        noa_8 = self._lag(noa, bs_pos, 7)
+        n_noa = (~np.isnan(noa_4)).astype(int) + (~np.isnan(noa_8)).astype(int)
+        with np.errstate(invalid="ignore"):
+            avg_noa = np.where(
+                n_noa > 0,
+                (np.nan_to_num(noa_4) + np.nan_to_num(noa_8)) / np.maximum(n_noa, 1),
+                np.nan,
+            )
+        # single value: AVG(x) == x exactly
+        avg_noa = np.where(n_noa == 1, np.where(np.isnan(noa_4), noa_8, noa_4), avg_noa)
+
+        self._bs = {
+            "dates": bs_df["period_end_date"].to_numpy().astype("datetime64[D]"),
+            "avg_noa": avg_noa,
+            "b0": bs_df["total_equity"].astype(float).to_numpy(),
+        }
+
+        self.loaded = True
+        print(f"✔ Preloaded fundamentals: {len(is_df)} IS rows, {len(bs_df)} BS rows, {len(self._is_slices)} symbols")
+        return self
+
+    # ---------- lookups ----------
+    def _latest(self, arrays: dict, slices: dict, symbol: str, asof: date) -> int | None:
+        """
+        Index of the latest row with period_end_date <= asof for symbol, or None.
+        """
+        if not self.loaded:
+            self.load()
+
+        bounds = slices.get(symbol)
+        if bounds is None:
+            return None
+
+        start, end = bounds
+        k = int(np.searchsorted(arrays["dates"][start:end], np.datetime64(asof, "D"), side="right"))
+        if k == 0:
+            return None
+        return start + k - 1
+
+    def has_valid_last4_quarters(self, symbol: str, asof: date) -> bool:
+        i = self._latest(self._is, self._is_slices, symbol, asof)
+        return i is not None and bool(self._is["valid_last4"][i])
+
+    def inputs(self, symbol: str, asof: date) -> dict | None:
+        """
+        Config independent valuation inputs as-of asof, or None where the SQL path returns no row.
+        Values are floats with NaN for NULL.
+        """
+        i = self._latest(self._is, self._is_slices, symbol, asof)
+        if i is None or not self._is["has_4"][i]:
+            return None
+
+        j = self._latest(self._bs, self._bs_slices, symbol, asof)
+
+        return {
+            "sustainable_ebit": self._is["sustainable_ebit"][i],
+            "shares_diluted": self._is["shares_diluted"][i],
+            "avg_noa": np.nan if j is None else self._bs["avg_noa"][j],
+            "b0": np.nan if j is None else self._bs["b0"][j],
+        }
+
+    def equity_val_penman_ttm_asof(self, symbol: str, asof: date, tax_rate: float, wacc: float) -> dict | None:
+        """
+        Same row as PenmanTTMAsOfStrategy.equity_val_penman_ttm_asof, served from memory.
+        """
+        x = self.inputs(symbol, asof)
+        if x is None:
+            return None
+
+        val = penman_value(x["sustainable_ebit"], x["avg_noa"], x["b0"], x["shares_diluted"], tax_rate, wacc)
+
+        return {
+            "equity_val_per_share": _nullable(val["equity_val_per_share"]),
+            "equity_val_total": _nullable(val["equity_val_total"]),
+            "shares_diluted": _nullable(x["shares_diluted"]),
+            "residual_earnings": _nullable(val["residual_earnings"]),
+            "rnoa": _nullable(val["rnoa"]),
+            "avg_noa": _nullable(x["avg_noa"]),
+            "b0": _nullable(x["b0"]),
+        }
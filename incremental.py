@@ -0,0 +1,250 @@
+"""
+Incremental (delta) backtesting: re-evaluates only the (symbol, period) pairs whose inputs are
+new or changed since the previous run, and merges the results into the existing outputs.
+
+Changes are detected with a snapshot of per-row fingerprints of the quarter table columns the
+valuation reads. A new, changed or deleted quarter row dated d makes every event of that symbol
+with period_end_date >= d stale (their as-of windows may include the row). Without a snapshot,
+everything after the last period_bucket in the valuations dataset counts as new.
+"""
+from __future__ import annotations
+
+import csv
+import heapq
+import os
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from data import PostgresDataHandler
+from engine import BacktestEngine
+from parallel import ShardBuyCollector
+from sink import HEADER, _csv_row
+from store import ParquetRecordStore
+from strategy import Strategy
+
+SNAPSHOT_PATH = "output/incremental_snapshot.parquet"
+
+# table -> columns the valuation depends on
+FINGERPRINT_COLUMNS = {
+    "quickfs_dj_incomestatementquarter": ["operating_income", "shares_diluted"],
+    "quickfs_dj_balancesheetquarter": ["net_operating_assets", "total_equity"],
+}
+
+
+def quarter_fingerprints(engine, symbols: list[str] | None) -> pd.DataFrame:
+    """
+    One row per quarter row of the universe: table, qfs_symbol_id, period_end_date, fp (uint64 hash).
+    """
+    frames = []
+    for table, cols in FINGERPRINT_COLUMNS.items():
+        where = "" if symbols is None else "WHERE qfs_symbol_id = ANY(:symbols)"
+        sql = text(f"SELECT qfs_symbol_id, period_end_date, {', '.join(cols)} FROM {table} {where}")
+
+        with engine.connect() as conn:
+            df = pd.read_sql(sql, conn, params={} if symbols is None else {"symbols": list(symbols)})
+
+        df["period_end_date"] = pd.to_datetime(df["period_end_date"]).dt.date
+        frames.append(pd.DataFrame({
+            "table": table,
+            "qfs_symbol_id": df["qfs_symbol_id"],
+            "period_end_date": df["period_end_date"],
+            # nullable int64, so the outer join in stale_cutoffs does not round hashes through float
+            "fp": pd.array(pd.util.hash_pandas_object(df[cols].astype(float), index=False).to_numpy().view(np.int64), dtype="Int64"),
+        }))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_snapshot(fingerprints: pd.DataFrame, path: str | Path = SNAPSHOT_PATH) -> None:
+    """
+    Stores the fingerprints the outputs now correspond to (atomically); any run that rewrites
+    the outputs, serial or parallel, saves one so the next incremental run diffs against it.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    fingerprints.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _next_month(d: date) -> date:
+    return (np.datetime64(d, "M") + 1).astype("datetime64[D]").item()
+
+
+def merge_buys(path: str | Path, cutoffs: dict[str, date], rows: list[tuple]) -> tuple[int, int]:
+    """
+    Replaces the buys of every symbol in cutoffs from its cutoff month on with rows
+    ((period_end_date, symbol, BuyEvent) as collected by ShardBuyCollector, i.e. in engine order).
+    The kept rows stay in their file order; the new rows are inserted between them by period
+    month, then symbol, the engine's dispatch order. The file is replaced atomically.
+    Returns (rows removed, rows added).
+    """
+    path = Path(path)
+    old = []
+    if path.exists():
+        with path.open("r", newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            old = list(reader)
+
+    # the csv holds the as-of trading date, which lies in the month of the period bucket
+    cutoff_months = {symbol: d.isoformat()[:7] for symbol, d in cutoffs.items()}
+    kept = [r for r in old if not (r[0] in cutoff_months and r[1][:7] >= cutoff_months[r[0]])]
+
+    # a merge, not a sort: neither the existing rows nor the new ones are reordered among themselves
+    new = [_csv_row(buy) for _, _, buy in rows]
+    merged = heapq.merge(kept, new, key=lambda r: (r[1][:7], r[0]))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        writer.writerows(merged)
+    os.replace(tmp, path)
+
+    return len(old) - len(kept), len(rows)
+
+
+class IncrementalDataHandler(PostgresDataHandler):
+    """
+    Streams only the events of the given symbols with period_end_date >= the symbol's cutoff.
+    """
+
+    def __init__(self, db_url: str, cutoffs: dict[str, date], chunk_size: int = 10_000):
+        super().__init__(db_url=db_url, symbols=sorted(cutoffs), chunk_size=chunk_size, start=min(cutoffs.values()))
+        self.cutoffs = cutoffs
+
+    def stream(self):
+        for symbol, ped in super().stream():
+            if ped >= self.cutoffs[symbol]:
+                yield symbol, ped
+
+
+class IncrementalBacktest:
+    """
+    Runs strategy only over the stale (symbol, period) pairs of the universe:
+
+      1. fingerprint the quarter rows and diff them against the snapshot of the last run
+      2. drop the stale rows from the valuations dataset and re-evaluate the stale events
+      3. merge the new buys into out_csv and save the new snapshot
+
+    The strategy must write its valuations to store. Price histories are not fingerprinted;
+    a restated price history needs a full run.
+    """
+
+    def __init__(
+        self,
+        db_url: str,
+        symbols: list[str] | None,
+        strategy: Strategy,
+        store: ParquetRecordStore,
+        out_csv: str = "output/buys.csv",
+        snapshot_path: str = SNAPSHOT_PATH,
+        dataset: str = "valuations_penman_ttm",
+        batched: bool = False,
+    ):
+        self.db_url = db_url
+        self.symbols = symbols
+        self.strategy = strategy
+        self.store = store
+        self.out_csv = out_csv
+        self.snapshot_path = Path(snapshot_path)
+        self.dataset = dataset
+        self.batched = batched
+
+    def fingerprints(self) -> pd.DataFrame:
+        engine = create_engine(self.db_url, future=True)
+        try:
+            return quarter_fingerprints(engine, self.symbols)
+        finally:
+            engine.dispose()
+
+    def save_snapshot(self, current: pd.DataFrame | None = None) -> None:
+        """
+        Stores the fingerprints the outputs now correspond to; call it after a full run as well.
+        """
+        if current is None:
+            current = self.fingerprints()
+        write_snapshot(current, self.snapshot_path)
+
+    def _last_bucket(self) -> date | None:
+        try:
+            df = self.store.scan(self.dataset, columns=["period_bucket"], date_col="period_bucket")
+        except FileNotFoundError:
+            return None
+        if df.empty:
+            return None
+        return date.fromisoformat(str(df["period_bucket"].iloc[-1]))
+
+    def stale_cutoffs(self, current: pd.DataFrame) -> dict[str, date]:
+        """
+        symbol -> first period_end_date to re-evaluate. Symbols without changes are absent.
+        """
+        symbols = current["qfs_symbol_id"].unique()
+
+        if not self.snapshot_path.exists():
+            last = self._last_bucket()
+            if last is None:
+                print("no snapshot and no previous valuations: evaluating the full history")
+                return {s: date.min for s in symbols}
+            print(f"no snapshot: evaluating the periods after {last}")
+            return {s: _next_month(last) for s in symbols}
+
+        previous = pd.read_parquet(self.snapshot_path)
+        previous["period_end_date"] = pd.to_datetime(previous["period_end_date"]).dt.date
+        if self.symbols is not None:
+            previous = previous[previous["qfs_symbol_id"].isin(symbols)]
+
+        keys = ["table", "qfs_symbol_id", "period_end_date"]
+        diff = current.merge(previous, on=keys, how="outer", suffixes=("", "_prev"), indicator=True)
+        # new, deleted or changed rows
+        stale = diff[(diff["_merge"] != "both") | (diff["fp"] != diff["fp_prev"]).fillna(True).astype(bool)]
+
+        first = stale.groupby("qfs_symbol_id")["period_end_date"].min()
+        return dict(zip(first.index, first.to_list()))
+
+    def run(self, current: pd.DataFrame | None = None) -> dict[str, date]:
+        """
+        current: fingerprints() of the universe if already read (e.g. for the valuation cache).
+        """
+        if current is None:
+            current = self.fingerprints()
+        cutoffs = self.stale_cutoffs(current)
+
+        if not cutoffs:
+            print("incremental: nothing changed upstream")
+            self.save_snapshot(current)
+            return cutoffs
+
+        print(f"incremental: {len(cutoffs)} symbols with new or changed quarters")
+
+        # stale valuations go first, the run appends their replacements
+        removed = self.store.delete_from(self.dataset, {s: d.isoformat() for s, d in cutoffs.items()})
+        print(f"removed {removed} stale valuation rows")
+
+        collector = ShardBuyCollector()
+        bt = BacktestEngine(
+            db_url=self.db_url,
+            symbols=sorted(cutoffs),
+            out_csv=None,
+            strategy=self.strategy,
+            batched=self.batched,
+            writer=collector,
+            data=IncrementalDataHandler(self.db_url, cutoffs),
+        )
+        collector.engine = bt
+        bt.run()
+
+        dropped, added = merge_buys(self.out_csv, cutoffs, collector.rows)
+        print(f"merged buys into {self.out_csv}: {dropped} rows replaced by {added}")
+
+        # outputs are consistent with current now
+        if hasattr(self.store, "flush"):
+            self.store.flush()
+        self.save_snapshot(current)
+        return cutoffs
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Sequence
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+from engine import BacktestEngine
+from events import BuyEvent, EventBatch
+from sink import CsvBuyWriter
+from store import BufferedParquetRecordStore, ParquetRecordStore
+from strategy import Strategy
+
+# (engine, store, shard symbols) -> strategy; must be a module-level function so it can be pickled
+StrategyFactory = Callable[[Engine, ParquetRecordStore, list[str]], Strategy]
+
+# (shard index, number of shards) inside a worker process, None elsewhere
+_WORKER: tuple[int, int] | None = None
+
+
+def current_worker() -> tuple[int, int] | None:
+    """
+    (shard index, number of shards) when called inside a ParallelBacktestRunner worker, else None.
+    Strategy factories use it to split process-shared budgets such as API rate limits.
+    """
+    return _WORKER
+
+
+def worker_share() -> float:
+    """
+    Fraction of a shared budget one process may use: 1/number of shards in a worker, 1 elsewhere.
+    """
+    return 1.0 if _WORKER is None else 1.0 / _WORKER[1]
+
+
+class ShardBuyCollector:
+    """
+    In-memory sink of a worker: keeps every BuyEvent with the period_end_date of the
+    market event that produced it, which is the serial engine's output order.
+    """
+
+    def __init__(self):
+        self.rows: list[tuple] = []   # (period_end_date, symbol, buy)
+        self.engine: BacktestEngine | None = None
+
+    def write(self, buy_event: BuyEvent):
+        self.rows.append((self.engine.period, buy_event.symbol, buy_event))
+
+    def write_batch(self, batch: EventBatch):
+        for buy_event in batch.buy_events():
+            self.write(buy_event)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _run_shard(db_url: str, symbols: list[str], build_strategy: StrategyFactory, store_root: str, batched: bool,
+               worker: tuple[int, int]) -> list[tuple]:
+    global _WORKER
+    _WORKER = worker
+
+    # every worker owns its engine, price provider (inside the strategy) and store writer
+    engine = create_engine(db_url, future=True)
+    try:
+        with BufferedParquetRecordStore(root_dir=store_root) as store:
+            strategy = build_strategy(engine, store, symbols)
+
+            collector = ShardBuyCollector()
+            bt = BacktestEngine(db_url=db_url, symbols=symbols, out_csv=None, strategy=strategy, batched=batched, writer=collector)
+            collector.engine = bt
+            bt.run()
+        return collector.rows
+    finally:
+        engine.dispose()
+
+
+class ParallelBacktestRunner:
+    """
+    Runs one BacktestEngine per shard of the symbol universe in a process pool.
+
+    Symbols are independent, so each worker processes a disjoint subset end to end. BuyEvents
+    are merged in (period_end_date, symbol) order with symbols in codepoint order, which is the
+    order the serial engine dispatches in (see PostgresDataHandler.stream_batches), and written
+    by one writer, so the output is identical to a serial run. Valuation records go to the
+    same store root; partitions are per symbol, so workers never share a partition. Datasets
+    listed in compact_datasets (none by default) are compacted at the end, which gives a
+    different file layout than a serial run.
+
+    Workers can read their share of process-shared budgets (e.g. an API rate limit) with worker_share().
+    """
+
+    def __init__(
+        self,
+        db_url: str,
+        symbols: list[str],
+        out_csv: str | None,
+        build_strategy: StrategyFactory,
+        n_workers: int | None = None,
+        store_root: str = "data",
+        batched: bool = False,
+        writer=None,
+        compact_datasets: Sequence[str] = (),
+    ):
+        self.db_url = db_url
+        self.symbols = symbols
+        self.build_strategy = build_strategy
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.store_root = store_root
+        self.batched = batched
+        self.writer = writer if writer is not None else CsvBuyWriter(out_csv)
+        self.compact_datasets = compact_datasets
+
+    def shards(self) -> list[list[str]]:
+        """
+        Round-robin over the sorted universe, which spreads long and short histories evenly.
+        """
+        universe = sorted(set(self.symbols))
+        n = max(1, min(self.n_workers, len(universe)))
+        return [universe[i::n] for i in range(n)]
+
+    def run(self):
+        shards = self.shards()
+        print(f"running {len(self.symbols)} symbols in {len(shards)} shards")
+
+        # spawn: workers start clean instead of inheriting the parent's connections/threads
+        with ProcessPoolExecutor(max_workers=len(shards), mp_context=mp.get_context("spawn")) as pool:
+            futures = [
+                pool.submit(_run_shard, self.db_url, shard, self.build_strategy, self.store_root, self.batched, (i, len(shards)))
+                for i, shard in enumerate(shards)
+            ]
+            rows = [row for future in futures for row in future.result()]
+
+        # codepoint order of symbols within a period, like the serial engine; equal keys keep shard order
+        rows.sort(key=lambda row: (row[0], row[1]))
+
+        # a fresh run must not append to the output of a previous one
+        self.writer.rotate()
+        try:
+            for _, _, buy in rows:
+                self.writer.write(buy)
+        finally:
+            self.writer.close()
+
+        store = ParquetRecordStore(root_dir=self.store_root)
+        for dataset in self.compact_datasets:
+            if (store.root / dataset).exists():
+                store.compact(dataset)
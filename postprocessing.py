@@ -1,10 +1,9 @@
 import os
-import time
-import requests
 import pandas as pd
-from io import StringIO
 from sqlalchemy import create_engine
 from priceprovider import EODHDPriceProvider
+from pricecache import PriceCache
+from symbolresolver import SymbolResolver
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,44 +12,21 @@ load_dotenv()
 INPUT_CSV = "output/buys.csv"
 OUTPUT_CSV = "buys_postprocessed.csv"
 
-# EODHD endpoint template
-EODHD_URL = "https://eodhd.com/api/eod/{symbol}?api_token={token}&fmt=csv"
+# same on-disk price cache the backtest writes (see main.py)
+PRICE_CACHE_DIR = "data/price_cache"
 
 
-def fetch_eod_history(eodhd_symbol: str, api_key: str, timeout=30, retries=3, backoff_sec=1.0) -> pd.DataFrame:
+def to_price_df(history: pd.DataFrame) -> pd.DataFrame:
     """
-    Fetch EOD history as CSV and return a DataFrame with at least columns:
-    ['date', 'close'] (date is datetime64).
+    Provider history (date index, EODHD columns) -> DataFrame with columns ['date', 'close']
+    (date is datetime64), sorted by date.
     """
-    url = EODHD_URL.format(symbol=eodhd_symbol, token=api_key)
-
-    last_err = None
-    for attempt in range(1, retries + 1):
-        try:
-            r = requests.get(url, timeout=timeout)
-            r.raise_for_status()
-
-            # EODHD returns CSV text
-            df = pd.read_csv(StringIO(r.text))
-
-            # Normalize column names
-            df.columns = [c.strip().lower() for c in df.columns]
-
-            if "date" not in df.columns or "close" not in df.columns:
-                raise ValueError(f"Unexpected columns for {eodhd_symbol}: {df.columns.tolist()}")
-
-            df["date"] = pd.to_datetime(df["date"], errors="coerce")
-            df = df.dropna(subset=["date", "close"]).copy()
-            df = df.sort_values("date")
-
-            return df
-
-        except Exception as e:
-            last_err = e
-            if attempt < retries:
-                time.sleep(backoff_sec * attempt)
-
-    raise RuntimeError(f"Failed to fetch EOD history for {eodhd_symbol}: {last_err}")
+    df = pd.DataFrame({
+        "date": pd.to_datetime(history.index, errors="coerce"),
+        "close": history["Close"].to_numpy(),
+    })
+    df = df.dropna(subset=["date", "close"])
+    return df.sort_values("date")
 
 
 def compute_metrics(price_df: pd.DataFrame, buy_date: pd.Timestamp, buy_price: float) -> dict:
@@ -99,6 +75,50 @@ def compute_metrics(price_df: pd.DataFrame, buy_date: pd.Timestamp, buy_price: f
     }
 
 
+def postprocess_buys(df_earliest: pd.DataFrame, price_provider: EODHDPriceProvider) -> list[dict]:
+    """
+    Computes the after-buy metrics for every row. Histories come from the provider's cache
+    (in memory or on disk); only missing or stale symbols are downloaded, concurrently through
+    the provider's pooled, rate-limited session.
+    """
+    price_provider.prefetch(df_earliest["symbol"].astype(str).tolist())
+
+    results = []
+    for _, row in df_earliest.iterrows():
+        symbol = str(row["symbol"])
+        buy_date = pd.Timestamp(row["period_end_date"])
+        buy_price = float(row["close_price"])
+
+        try:
+            history = price_provider.history(symbol)
+            if history.empty:
+                raise RuntimeError(f"no price data for {symbol}")
+
+            metrics = compute_metrics(to_price_df(history), buy_date, buy_price)
+            status = "ok"
+            error = None
+        except Exception as e:
+            metrics = {
+                "max_close_after_buy": None,
+                "max_close_date": None,
+                "max_return": None,
+                "days_to_max": None,
+                "double_date": None,
+                "days_to_double": None,
+            }
+            status = "error"
+            error = str(e)
+
+        out_row = row.to_dict()
+        out_row["eodhd_symbol"] = price_provider.source(symbol)
+        out_row.update(metrics)
+        out_row["fetch_status"] = status
+        out_row["fetch_error"] = error
+        results.append(out_row)
+
+    return results
+
+
 def main():
     api_key = os.environ['EODHD_API_KEY']
     print('api key: ', api_key)
@@ -125,50 +145,11 @@ def main():
     #create db engine to fetch exchange of symbol
     engine = create_engine(db_url, future=True)
 
-    price_provider = EODHDPriceProvider(engine)
-
-
-    results = []
-    for _, row in df_earliest.iterrows():
-        symbol = str(row["symbol"])
-        buy_date = pd.Timestamp(row["period_end_date"])
-        buy_price = float(row["close_price"])
-
-        #eodhd_symbol = to_eodhd_symbol(symbol)
-        eodhd_symbols = price_provider._transform_symbol(symbol)
-
-        try:
-            for eodhd_symbol in eodhd_symbols:
-                try:
-                    price_df = fetch_eod_history(eodhd_symbol, api_key)
-                    metrics = compute_metrics(price_df, buy_date, buy_price)
-                    status = "ok"
-                    error = None
-                    break
-                except Exception as e:
-                    print(f'eodhd_symbol not available: {eodhd_symbol}')
-                
-        except Exception as e:
-            metrics = {
-                "max_close_after_buy": None,
-                "max_close_date": None,
-                "max_return": None,
-                "days_to_max": None,
-                "double_date": None,
-                "days_to_double": None,
-            }
-            status = "error"
-            error = str(e)
-
-        out_row = row.to_dict()
-        out_row["eodhd_symbol"] = eodhd_symbol
-        out_row.update(metrics)
-        out_row["fetch_status"] = status
-        out_row["fetch_error"] = error
-        results.append(out_row)
+    #symbols resolved during the backtest come from the local resolution file, no db queries
+    resolver = SymbolResolver(engine).load(df_earliest["symbol"].astype(str).tolist())
+    price_provider = EODHDPriceProvider(engine, cache=PriceCache(PRICE_CACHE_DIR), resolver=resolver)
 
-        # Be nice to the API (basic rate-limiting)
-        time.sleep(0.2)
+    results = postprocess_buys(df_earliest, price_provider)
 
     out_df = pd.DataFrame(results)
 
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class PriceCache:
+    """
+    Persistent per-symbol price history cache, one Parquet file per symbol:
+
+      cache_dir/
+        WLDN_US.parquet
+        MULT_DE.parquet
+
+    The file's mtime is the time of the last (full or incremental) fetch; the price source
+    symbol it was fetched from (e.g. the EODHD ticker) is kept in the file's schema metadata.
+    Symbols without data are cached as empty files so they are not retried on every run.
+
+    Freshness policy:
+      max_age=timedelta(days=1) -> refresh once the file is older than one day
+      max_age=None              -> never refresh, cached histories are final (historical runs, offline)
+    """
+
+    META_KEY = b"price_cache"
+
+    def __init__(self, cache_dir: str | Path = "data/price_cache", max_age: timedelta | None = timedelta(days=1)):
+        self.root = Path(cache_dir)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age
+
+    def _path(self, symbol: str) -> Path:
+        safe = symbol.replace(":", "_").replace("/", "_").replace("\\", "_")
+        return self.root / f"{safe}.parquet"
+
+    def has(self, symbol: str) -> bool:
+        return self._path(symbol).exists()
+
+    def is_fresh(self, symbol: str) -> bool:
+        p = self._path(symbol)
+        if not p.exists():
+            return False
+        if self.max_age is None:
+            return True
+        return (time.time() - p.stat().st_mtime) <= self.max_age.total_seconds()
+
+    def source(self, symbol: str) -> str | None:
+        """
+        Price source symbol the cached history was fetched from, None if unknown or missing.
+        """
+        p = self._path(symbol)
+        if not p.exists():
+            return None
+        meta = pq.read_schema(p).metadata or {}
+        raw = meta.get(self.META_KEY)
+        if raw is None:
+            return None
+        return json.loads(raw).get("source") or None
+
+    def get(self, symbol: str, index_col: str) -> pd.DataFrame | None:
+        """
+        Cached history indexed by index_col (python dates), None if the symbol was never cached.
+        """
+        p = self._path(symbol)
+        if not p.exists():
+            return None
+
+        df = pd.read_parquet(p, engine="pyarrow")
+        if df.empty or index_col not in df.columns:
+            return pd.DataFrame()
+        return df.set_index(index_col)
+
+    def put(self, symbol: str, df: pd.DataFrame, index_col: str, source: str | None) -> None:
+        """
+        Writes the full history of symbol (atomically replaces the cached file).
+        """
+        if df.empty:
+            table = pa.table({index_col: pa.array([], type=pa.date32())})
+        else:
+            table = pa.Table.from_pandas(df.reset_index().rename(columns={"index": index_col}), preserve_index=False)
+
+        meta = dict(table.schema.metadata or {})
+        meta[self.META_KEY] = json.dumps({"source": source}).encode()
+        table = table.replace_schema_metadata(meta)
+
+        p = self._path(symbol)
+        tmp = p.with_suffix(".parquet.tmp")
+        pq.write_table(table, tmp, compression="snappy")
+        os.replace(tmp, p)
+
+    def touch(self, symbol: str) -> None:
+        """
+        Marks a cached history as fresh without rewriting it (nothing new upstream).
+        """
+        p = self._path(symbol)
+        if p.exists():
+            os.utime(p)
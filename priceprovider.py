@@ -1,33 +1,113 @@
+import numpy as np
 import pandas as pd
 import pandas_datareader.data as web
-import calendar
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from pathlib import Path
 from sqlalchemy import text
 from helpers import EXCHANGE_MAPPING
+from pricecache import PriceCache
+from symbolresolver import SymbolResolver
+from profiling import timed
 import os
+import json
 from io import StringIO
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from httpclient import TokenBucket, build_session
 
 MISSING_SYMBOLS_FILE = Path("output/missing_price_symbols.txt")
 MISSING_SYMBOLS_FILE.parent.mkdir(parents=True, exist_ok=True)
 
 
+class MonthCloseIndex:
+    """
+    year-month -> (last trading date, close) of one price history, built once per symbol.
+
+    Months are counted from 1970-01 and stored as offsets from the first month of the history,
+    so a lookup is a direct array index instead of a pandas filter over the full history.
+    """
+
+    def __init__(self, dates: np.ndarray, closes: np.ndarray):
+        # dates must be sorted ascending
+        self._dates = np.asarray(dates, dtype="datetime64[D]")
+        self._closes = np.asarray(closes, dtype=float)
+
+        if len(self._dates) == 0:
+            self._first_month = 0
+            self._pos = np.zeros(0, dtype=np.int64)
+            return
+
+        months = self._dates.astype("datetime64[M]").astype(np.int64)
+        # last row of every month
+        last = np.flatnonzero(np.r_[months[1:] != months[:-1], True])
+
+        self._first_month = int(months[0])
+        self._pos = np.full(int(months[-1]) - self._first_month + 1, -1, dtype=np.int64)
+        self._pos[months[last] - self._first_month] = last
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, close_col: str) -> "MonthCloseIndex":
+        if df.empty:
+            return cls(np.zeros(0, dtype="datetime64[D]"), np.zeros(0))
+        dates = pd.to_datetime(df.index).values.astype("datetime64[D]")
+        return cls(dates, df[close_col].to_numpy(dtype=float))
+
+    def lookup(self, month_start: date):
+        """
+        (price_date, close) of the last trading day in month_start's month, or (None, None).
+        Like the original filter, only days >= month_start count.
+        """
+        i = (month_start.year - 1970) * 12 + (month_start.month - 1) - self._first_month
+        if i < 0 or i >= len(self._pos):
+            return None, None
+
+        row = self._pos[i]
+        if row < 0:
+            return None, None
+
+        price_date = self._dates[row]
+        if price_date < np.datetime64(month_start, "D"):
+            return None, None
+        return price_date.item(), float(self._closes[row])
+
+
 # @dataclass
 # class LocalStooqConfig:
 #     root: Path  # e.g. Path("stooq_daily_data")
 #     missing_log: Path = Path("output/missing_price_symbols.txt")
 
 
+EODHD_BASE_URL = "https://eodhd.com/api"
+
+
 class EODHDPriceProvider:
     """
     Gets daily price history from https://eodhd.com/
+
+    With a PriceCache, histories are persisted on disk: later runs read them locally and only
+    fetch the days after the last cached date once the cached copy is stale.
+    base_url can point to a local stand-in of the API.
+
+    Requests go through a pooled keep-alive session with retries and a token-bucket rate limit;
+    prefetch() downloads many histories concurrently.
+
+    With a SymbolResolver, qfs symbols are mapped to EODHD tickers without per-symbol DB queries.
     """
-    def __init__(self, engine):
+    def __init__(self, engine, cache: PriceCache | None = None, base_url: str = EODHD_BASE_URL,
+                 max_workers: int = 8, requests_per_second: float | None = 10.0, timeout: float = 30,
+                 resolver: SymbolResolver | None = None):
         self.date_col_name = "Date"
         self.close_price_col_name = "Close"
         self.engine = engine
+        self.resolver = resolver
+        self.disk_cache = cache
+        self.base_url = base_url.rstrip("/")
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = build_session(pool_size=max_workers)
+        self.rate_limiter = TokenBucket(requests_per_second) if requests_per_second else None
         self._cache: dict[str, pd.DataFrame] = {}     # symbol -> df
+        self._sources: dict[str, str] = {}            # symbol -> eodhd ticker the history came from
+        self._month_index: dict[str, MonthCloseIndex] = {}     # symbol -> month-end closes
 
     def _log_missing_symbols(self, symbol, candidates):
         # ts = datetime.utcnow().isoformat(timespec="seconds")
@@ -40,6 +120,9 @@ class EODHDPriceProvider:
         """
         returns exchange for a given qfs symbol
         """
+        if self.resolver is not None and self.resolver.knows(qfs_symbol):
+            return self.resolver.exchange(qfs_symbol)
+
         query = text("""
             SELECT exchange
             from quickfs_dj_tradedcompanies
@@ -53,6 +136,13 @@ class EODHDPriceProvider:
         return None
 
     def _transform_symbol(self, qfs_symbol: str) -> list[str] | None:
+        #precomputed candidates of the bulk resolution
+        if self.resolver is not None and self.resolver.knows(qfs_symbol):
+            eodhd_symbols = self.resolver.candidates(qfs_symbol)
+            if eodhd_symbols is None and ":" in qfs_symbol:
+                print(f'{qfs_symbol} not able to transform for EODHD')
+            return eodhd_symbols
+
         #parse everything after : of qfs symbol
         if ":" in qfs_symbol:
             ticker, country_code = qfs_symbol.split(":")
@@ -75,10 +165,72 @@ class EODHDPriceProvider:
 
         return None
     
+    @timed("prices.http_fetch")
+    def _fetch(self, eodhd_symbol: str, start: date | None = None) -> pd.DataFrame:
+        """
+        Downloads the EOD history of one EODHD ticker (optionally only from start on), indexed by date.
+        Raises if the ticker is not available.
+        """
+        url = f"{self.base_url}/eod/{eodhd_symbol}?api_token={os.environ['EODHD_API_KEY']}&fmt=csv"
+        if start is not None:
+            url += f"&from={start.isoformat()}"
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        resp = self.session.get(url, timeout=self.timeout)
+        resp.raise_for_status()
+
+        #read csv file
+        df = pd.read_csv(StringIO(resp.text))
+
+        #create index based on date
+        df[self.date_col_name] =  pd.to_datetime(df[self.date_col_name].astype(str),format="%Y-%m-%d", errors="raise").dt.date
+        df = df.sort_values(self.date_col_name).set_index(self.date_col_name)
+        return df
+
+    def _update_cached(self, symbol: str, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Appends the days after the last cached date to a stale cached history.
+        Keeps the cached copy if the source is unknown or the update fails.
+        """
+        source = self.disk_cache.source(symbol)
+        if source is None:
+            return df
+
+        try:
+            new = self._fetch(source, start=df.index[-1] + timedelta(days=1))
+        except Exception as e:
+            print(f"incremental update of {symbol} ({source}) failed, using cached prices: {e}")
+            return df
+
+        new = new.loc[new.index > df.index[-1]]
+        if new.empty:
+            self.disk_cache.touch(symbol)
+            return df
+
+        df = pd.concat([df, new])
+        self.disk_cache.put(symbol, df, index_col=self.date_col_name, source=source)
+        return df
+
     def _load_symbol(self, symbol: str) -> pd.DataFrame:
         #check if historical price data has already been downloaded
         if symbol in self._cache:
             return self._cache[symbol]
+
+        #check the persistent cache next
+        if self.disk_cache is not None:
+            df = self.disk_cache.get(symbol, index_col=self.date_col_name)
+            if df is not None:
+                if not df.empty and not self.disk_cache.is_fresh(symbol):
+                    df = self._update_cached(symbol, df)
+
+                #empty means the symbol was missing last time; retry only once that is stale
+                if not df.empty or self.disk_cache.is_fresh(symbol):
+                    source = self.disk_cache.source(symbol)
+                    if source is not None:
+                        self._sources[symbol] = source
+                    self._cache[symbol] = df
+                    return df
         
         #if symbol not yet in cache, fetch from API endpoint
         #transform qfs symbol to eodhd symbol
@@ -88,18 +240,13 @@ class EODHDPriceProvider:
             #try to fetch data from eodhd api
             for eodhd_symbol in eodhd_symbols:
                 try:
-                    url = f"https://eodhd.com/api/eod/{eodhd_symbol}?api_token={os.environ['EODHD_API_KEY']}&fmt=csv"
-                    resp = requests.get(url)
-
-                    #read csv file
-                    df = pd.read_csv(StringIO(resp.text))
-
-                    #create index based on date
-                    df[self.date_col_name] =  pd.to_datetime(df[self.date_col_name].astype(str),format="%Y-%m-%d", errors="raise").dt.date
-                    df = df.sort_values(self.date_col_name).set_index(self.date_col_name)
+                    df = self._fetch(eodhd_symbol)
 
                     #store price data frame in cache
                     self._cache[symbol] = df
+                    self._sources[symbol] = eodhd_symbol
+                    if self.disk_cache is not None:
+                        self.disk_cache.put(symbol, df, index_col=self.date_col_name, source=eodhd_symbol)
                     return df
                 except Exception as e:
                     print(f"eodhd_symbol {eodhd_symbol} not available in price endpoint")
@@ -109,6 +256,8 @@ class EODHDPriceProvider:
 
             df = pd.DataFrame()
             self._cache[symbol] = df
+            if self.disk_cache is not None:
+                self.disk_cache.put(symbol, df, index_col=self.date_col_name, source=None)
             return df
         else:
             self._log_missing_symbols(symbol=symbol, candidates=eodhd_symbols)
@@ -116,30 +265,138 @@ class EODHDPriceProvider:
             #store empty dataframe
             df = pd.DataFrame()
             self._cache[symbol] = df
+            if self.disk_cache is not None:
+                self.disk_cache.put(symbol, df, index_col=self.date_col_name, source=None)
             print(f"empty dataframe for symbol: {symbol}, because not able to create eodhd ticker")
             return df
 
+    def history(self, symbol: str) -> pd.DataFrame:
+        """
+        Full daily history of a qfs symbol indexed by date (empty if not available).
+        """
+        return self._load_symbol(symbol)
+
+    def source(self, symbol: str) -> str | None:
+        """
+        EODHD ticker the history of symbol was loaded from, None if not loaded or missing.
+        """
+        return self._sources.get(symbol)
+
+    @timed("prices.prefetch")
+    def prefetch(self, symbols: list[str]) -> None:
+        """
+        Loads the histories of all symbols concurrently (bounded by max_workers), so the event loop
+        only hits the in-memory cache. Each symbol still falls back over its EODHD candidates.
+        """
+        todo = [s for s in dict.fromkeys(symbols) if s not in self._cache]
+        if not todo:
+            return
+
+        print(f"prefetching prices for {len(todo)} symbols with {self.max_workers} workers")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self._load_symbol, symbol): symbol for symbol in todo}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"prefetch failed for {futures[future]}: {e}")
+
+    @timed("prices.last_close_in_month")
     def last_close_in_month(self, symbol: str, month_start: date):
-        #load historical price data of symbol
-        df = self._load_symbol(symbol)
+        #month-end index is built once per symbol from the historical price data
+        index = self._month_index.get(symbol)
+        if index is None:
+            index = MonthCloseIndex.from_frame(self._load_symbol(symbol), self.close_price_col_name)
+            self._month_index[symbol] = index
 
-        #if data frame is empty return none for close price and date
-        if df.empty:
-            return None, None
-        
-        #extract date range
-        year, month = month_start.year, month_start.month
-        last_dom = calendar.monthrange(year, month)[1]
-        month_end = date(year, month, last_dom)
-
-        #filter historical close price data frame
-        m = df.loc[(df.index >= month_start) & (df.index <= month_end)]
-        if m.empty:
-            return None, None
+        return index.lookup(month_start)
+
+
+class StooqManifest:
+    """
+    One-time index of a Stooq bulk tree: normalized ticker file name -> {country: relative path}.
+
+    Persisted as JSON next to the data (<root>.manifest.json, outside the tree so writing it does
+    not touch the tree's mtimes) together with the mtime of every directory in the tree.
+    Adding or removing a file or folder changes the mtime of its parent directory, so the
+    manifest is rebuilt only when one of the recorded directories changed or disappeared.
+    """
+
+    VERSION = 1
+
+    def __init__(self, root: Path, path: Path | None = None):
+        self.root = Path(root)
+        self.path = Path(path) if path is not None else self.root.parent / f"{self.root.name}.manifest.json"
+        self.files: dict[str, dict[str, str]] = {}   # "aapl.us" -> {"us": "us/nasdaq/1/aapl.us.txt"}
+        self.countries: list[str] = []
+
+    def _is_valid(self, data: dict) -> bool:
+        if data.get("version") != self.VERSION:
+            return False
+        for rel, mtime_ns in data.get("dirs", {}).items():
+            try:
+                if os.stat(self.root / rel).st_mtime_ns != mtime_ns:
+                    return False
+            except FileNotFoundError:
+                return False
+        return True
+
+    def build(self) -> None:
+        files: dict[str, dict[str, str]] = {}
+        dirs: dict[str, int] = {}
+
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            rel = os.path.relpath(dirpath, self.root)
+            dirs[rel] = os.stat(dirpath).st_mtime_ns
+
+            # only files inside country folders are price files
+            if rel == ".":
+                continue
+            country = Path(rel).parts[0]
+
+            for fn in sorted(filenames):
+                if fn.lower().endswith(".txt"):
+                    name = fn[:-4].lower()
+                    files.setdefault(name, {}).setdefault(country, Path(rel, fn).as_posix())
+
+        self.files = files
+        self.countries = sorted(p.name for p in self.root.iterdir() if p.is_dir())
+
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "dirs": dirs, "countries": self.countries, "files": files}, f)
+        os.replace(tmp, self.path)
+        print(f"✔ Built Stooq manifest: {len(files)} tickers in {len(dirs)} folders -> {self.path}")
+
+    def load(self) -> "StooqManifest":
+        if self.path.exists():
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+            if self._is_valid(data):
+                self.files = data["files"]
+                self.countries = data["countries"]
+                return self
+
+        self.build()
+        return self
+
+    def find(self, candidates: list[str], country: str | None) -> Path | None:
+        """
+        Same search order as the recursive scan: preferred country first, then all other
+        country folders; within a country the candidates in order.
+        """
+        if country and country in self.countries:
+            countries = [country] + [c for c in self.countries if c != country]
+        else:
+            countries = self.countries
 
-        price_date = m.index[-1]
-        close = float(m[self.close_price_col_name].iloc[-1])
-        return price_date, close
+        for c in countries:
+            for cand in candidates:
+                rel = self.files.get(cand.lower(), {}).get(c)
+                if rel is not None:
+                    return self.root / rel
+        return None
 
 
 class LocalStooqPriceProvider:
@@ -158,9 +415,12 @@ class LocalStooqPriceProvider:
             ...
       uk/
         ...
+
+    File resolution goes through a persisted StooqManifest (use_manifest=True) instead of
+    a recursive scan per symbol.
     """
 
-    def __init__(self, root: Path):
+    def __init__(self, root: Path, use_manifest: bool = True):
         # self.cfg = cfg
         # self.cfg.missing_log.parent.mkdir(parents=True, exist_ok=True)
         self.root = Path(root)
@@ -172,6 +432,10 @@ class LocalStooqPriceProvider:
         
         self._cache: dict[str, pd.DataFrame] = {}     # symbol -> df
         self._file_cache: dict[str, Path] = {}        # symbol -> resolved file path
+        self._month_index: dict[str, MonthCloseIndex] = {}     # symbol -> month-end closes
+
+        self.use_manifest = use_manifest
+        self._manifest: StooqManifest | None = None   # built/loaded on first lookup
 
     # ---------- symbol normalization ----------
     def _parse_country(self, symbol: str) -> str | None:
@@ -230,6 +494,15 @@ class LocalStooqPriceProvider:
         country = self._parse_country(symbol)
         candidates = self._candidates(symbol)
 
+        if self.use_manifest:
+            if self._manifest is None:
+                self._manifest = StooqManifest(self.root).load()
+
+            hit = self._manifest.find(candidates, country)
+            if hit is not None:
+                self._file_cache[symbol] = hit
+            return hit
+
         for croot in self._country_roots_in_priority_order(country):
             # recursive scan, but only for candidates, so it’s not too crazy
             for cand in candidates:
@@ -305,27 +578,103 @@ class LocalStooqPriceProvider:
         return df
 
     # ---------- main API ----------
+    @timed("prices.last_close_in_month")
     def last_close_in_month(self, symbol: str, month_start: date):
-        df = self._load_symbol(symbol)
-        if df.empty:
-            return None, None
+        index = self._month_index.get(symbol)
+        if index is None:
+            index = MonthCloseIndex.from_frame(self._load_symbol(symbol), self.close_price_col_name)
+            self._month_index[symbol] = index
 
-        year, month = month_start.year, month_start.month
-        last_dom = calendar.monthrange(year, month)[1]
-        month_end = date(year, month, last_dom)
+        return index.lookup(month_start)
 
-        m = df.loc[(df.index >= month_start) & (df.index <= month_end)]
-        if m.empty:
-            return None, None
 
-        price_date = m.index[-1]
-        close = float(m[self.close_price_col_name].iloc[-1])
-        return price_date, close
+class MmapStooqPriceProvider(LocalStooqPriceProvider):
+    """
+    Reads prices from the columnar store written by stooqstore.py instead of the TXT tree.
+
+    The dates / closes bins named in index.json are opened once with np.memmap; a symbol's history is a zero-copy
+    slice of them, so there is no CSV parsing at startup and pages are shared through the
+    OS page cache. Symbol candidates and country priority are the same as LocalStooqPriceProvider.
+    """
+
+    def __init__(self, store_dir: Path):
+        # base state (caches, column names); the store replaces the TXT tree, so no manifest
+        super().__init__(store_dir, use_manifest=False)
+        self.store_dir = Path(store_dir)
+
+        index_path = self.store_dir / "index.json"
+        if not index_path.exists():
+            raise ValueError(f"Stooq price store does not exist: {self.store_dir} (run stooqstore.py first)")
+
+        with index_path.open("r", encoding="utf-8") as f:
+            index = json.load(f)
+
+        self._countries: list[str] = index["countries"]
+        self._symbols: dict[str, dict[str, list[int]]] = index["symbols"]
+
+        if index["rows"] > 0:
+            # stores of index version 1 have fixed file names
+            self._dates = np.memmap(self.store_dir / index.get("dates_file", "dates.bin"), dtype=np.int64, mode="r").view("datetime64[D]")
+            self._closes = np.memmap(self.store_dir / index.get("closes_file", "closes.bin"), dtype=np.float64, mode="r")
+        else:
+            self._dates = np.zeros(0, dtype="datetime64[D]")
+            self._closes = np.zeros(0)
+
+        self._slices: dict[str, tuple[int, int] | None] = {}   # symbol -> (start, end), None if missing
+
+    def _slice(self, symbol: str) -> tuple[int, int] | None:
+        if symbol in self._slices:
+            return self._slices[symbol]
+
+        country = self._parse_country(symbol)
+        candidates = self._candidates(symbol)
+
+        if country and country in self._countries:
+            countries = [country] + [c for c in self._countries if c != country]
+        else:
+            countries = self._countries
+
+        for c in countries:
+            for cand in candidates:
+                bounds = self._symbols.get(cand, {}).get(c)
+                if bounds is not None:
+                    self._slices[symbol] = (bounds[0], bounds[1])
+                    return self._slices[symbol]
+
+        self._log_missing_symbols(symbol, candidates)
+        self._slices[symbol] = None
+        return None
+
+    def history(self, symbol: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (dates, closes) of a symbol as read-only views into the store; empty if missing.
+        """
+        bounds = self._slice(symbol)
+        if bounds is None:
+            return self._dates[:0], self._closes[:0]
+        start, end = bounds
+        return self._dates[start:end], self._closes[start:end]
+
+    def _load_symbol(self, symbol: str) -> pd.DataFrame:
+        dates, closes = self.history(symbol)
+        if len(dates) == 0:
+            return pd.DataFrame()
+        return pd.DataFrame({self.close_price_col_name: closes}, index=pd.Index(dates.astype(object), name=self.date_col_name))
+
+    @timed("prices.last_close_in_month")
+    def last_close_in_month(self, symbol: str, month_start: date):
+        index = self._month_index.get(symbol)
+        if index is None:
+            index = MonthCloseIndex(*self.history(symbol))
+            self._month_index[symbol] = index
+
+        return index.lookup(month_start)
 
 
 class StooqPriceProvider:
     def __init__(self):
         self._cache: dict[str, pd.DataFrame] = {}
+        self._month_index: dict[str, MonthCloseIndex] = {}     # symbol -> month-end closes
 
     def _to_stooq_candidates(self, symbol: str) -> list[str]:
         """
@@ -392,22 +741,16 @@ class StooqPriceProvider:
         #     self._cache[symbol] = df
         # return self._cache[symbol]
 
+    @timed("prices.last_close_in_month")
     def last_close_in_month(self, symbol: str, month_start: date):
         """
         month_start is your DB date: 01-MM-YYYY.
         Returns (price_date, close) for last available trading day in that month.
         """
-        df = self._load_symbol(symbol, start_date=month_start)
-
-        year, month = month_start.year, month_start.month
-        last_dom = calendar.monthrange(year, month)[1]
-        month_end = date(year, month, last_dom)
-
-        # slice using date-index
-        m = df.loc[(df.index >= month_start) & (df.index <= month_end)]
-        if m.empty:
-            return None, None
+        index = self._month_index.get(symbol)
+        if index is None:
+            df = self._load_symbol(symbol, start_date=month_start)
+            index = MonthCloseIndex.from_frame(df, "Close")
+            self._month_index[symbol] = index
 
-        price_date = m.index[-1]
-        close = float(m["Close"].iloc[-1])
-        return price_date, close
\ No newline at end of file
+        return index.lookup(month_start)
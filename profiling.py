@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# latency histogram: bucket i holds calls that took < 2**i microseconds (last bucket: everything slower)
+N_BUCKETS = 32
+
+
+class StageStats:
+    __slots__ = ("count", "total_ns", "max_ns", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * N_BUCKETS
+
+    def add(self, ns: int) -> None:
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+        self.buckets[min((ns // 1000).bit_length(), N_BUCKETS - 1)] += 1
+
+    def quantile_us(self, q: float) -> float:
+        """
+        Upper bound (in microseconds) of the histogram bucket containing quantile q.
+        """
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return float(2 ** i)
+        return float(2 ** (N_BUCKETS - 1))
+
+
+class Instrumentation:
+    """
+    Per-stage call counts and latency histograms for a backtest run.
+
+    Disabled by default: instrumented code then only pays for one attribute check per call.
+    Stages nest (e.g. strategy.on_market contains the price lookup and the SQL queries),
+    so totals of different stages are not additive. Recording is thread-safe (e.g. the
+    price prefetch pool records from its worker threads).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages: dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages = {}
+
+    def record(self, name: str, ns: int) -> None:
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.add(ns)
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter_ns() - t0)
+
+    def timed(self, name: str):
+        """
+        Decorator that records every call of the function under name.
+        """
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                t0 = time.perf_counter_ns()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter_ns() - t0)
+            return wrapper
+        return decorator
+
+    def iter(self, name: str, iterable):
+        """
+        Wraps an iterator and records the time spent producing every item.
+        """
+        it = iter(iterable)
+        while True:
+            t0 = time.perf_counter_ns()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            if self.enabled:
+                self.record(name, time.perf_counter_ns() - t0)
+            yield item
+
+    def summary(self) -> list[dict]:
+        with self._lock:
+            stages = list(self.stages.items())
+
+        rows = []
+        for name, s in sorted(stages, key=lambda kv: kv[1].total_ns, reverse=True):
+            rows.append({
+                "stage": name,
+                "calls": s.count,
+                "total_s": s.total_ns / 1e9,
+                "mean_us": s.total_ns / s.count / 1e3 if s.count else 0.0,
+                "p50_us": s.quantile_us(0.50),
+                "p90_us": s.quantile_us(0.90),
+                "p99_us": s.quantile_us(0.99),
+                "max_us": s.max_ns / 1e3,
+            })
+        return rows
+
+    def report(self) -> str:
+        lines = [f"{'stage':<40} {'calls':>10} {'total s':>10} {'mean us':>10} {'p50<us':>9} {'p90<us':>9} {'p99<us':>9} {'max us':>11}"]
+        for r in self.summary():
+            lines.append(
+                f"{r['stage']:<40} {r['calls']:>10} {r['total_s']:>10.3f} {r['mean_us']:>10.1f} "
+                f"{r['p50_us']:>9.0f} {r['p90_us']:>9.0f} {r['p99_us']:>9.0f} {r['max_us']:>11.1f}"
+            )
+        return "\n".join(lines)
+
+
+# process wide instance used by the engine, strategies, providers, store and sinks
+INSTRUMENTS = Instrumentation()
+timed = INSTRUMENTS.timed
@@ -1,7 +1,45 @@
 import csv
+import io
+import shutil
+import uuid
 from pathlib import Path
 
-from events import BuyEvent
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from events import BuyEvent, EventBatch, BUY_VALUE_FIELDS
+from profiling import timed
+from store import part_filename, remove_run_parts
+
+HEADER = ["symbol", "period_end_date", "close_price", "intrinsic_value", "bps", "rnoa", "MoS", "nrShares", "reason"]
+
+
+def _csv_row(buy_event: BuyEvent) -> list:
+    return [
+        buy_event.symbol,
+        buy_event.period_end_date.isoformat(),
+        "" if buy_event.close_price is None else buy_event.close_price,
+        "" if buy_event.intrinsic_value is None else buy_event.intrinsic_value,
+        "" if buy_event.bps is None else buy_event.bps,
+        "" if buy_event.rnoa is None else buy_event.rnoa,
+        "" if buy_event.mos is None else buy_event.mos,
+        "" if buy_event.nr_shares is None else buy_event.nr_shares,
+        buy_event.reason,
+    ]
+
+
+def _csv_rows(batch: EventBatch):
+    """
+    CSV rows of a columnar batch, same formatting as _csv_row (NaN is written as an empty field).
+    """
+    symbols = batch.symbol_column().tolist()
+    dates = batch.period_end_dates.astype(str).tolist()
+    columns = [batch.values[name].tolist() for name in BUY_VALUE_FIELDS]
+    reasons = batch.reasons or [""] * len(batch)
+
+    for i in range(len(batch)):
+        yield [symbols[i], dates[i], *("" if col[i] != col[i] else col[i] for col in columns), reasons[i]]
 
 
 class CsvBuyWriter:
@@ -10,19 +48,247 @@ class CsvBuyWriter:
         self.path.parent.mkdir(parents=True, exist_ok=True)
 
         if not self.path.exists():
-            with self.path.open("w", newline="", encoding="utf-8") as f:
-                csv.writer(f).writerow(["symbol", "period_end_date", "close_price", "intrinsic_value", "bps", "rnoa", "MoS", "nrShares", "reason"])
+            self._write_header()
+
+    def _write_header(self):
+        with self.path.open("w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(HEADER)
+
+    def rotate(self):
+        """
+        Starts a fresh file; the rows of a previous run are moved to <name>.prev.csv.
+        """
+        if self.path.exists():
+            self.path.replace(self.path.with_suffix(".prev" + self.path.suffix))
+        self._write_header()
 
     def write(self, buy_event: BuyEvent):
         with self.path.open("a", newline="", encoding="utf-8") as f:
-            csv.writer(f).writerow([
-                buy_event.symbol,
-                buy_event.period_end_date.isoformat(),
-                "" if buy_event.close_price is None else buy_event.close_price,
-                "" if buy_event.intrinsic_value is None else buy_event.intrinsic_value,
-                "" if buy_event.bps is None else buy_event.bps,
-                "" if buy_event.rnoa is None else buy_event.rnoa,
-                "" if buy_event.mos is None else buy_event.mos,
-                "" if buy_event.nr_shares is None else buy_event.nr_shares,
-                buy_event.reason,
-            ])
\ No newline at end of file
+            csv.writer(f).writerow(_csv_row(buy_event))
+
+    def write_batch(self, batch: EventBatch):
+        with self.path.open("a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(_csv_rows(batch))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def checkpoint(self) -> dict:
+        """
+        Marker of everything written so far, see rollback().
+        """
+        return {"size": self.path.stat().st_size}
+
+    def rollback(self, marker: dict):
+        """
+        Drops the rows written after checkpoint() returned marker.
+        """
+        with self.path.open("r+b") as f:
+            f.truncate(marker["size"])
+
+
+class BufferedBuyWriter:
+    """
+    Base for sinks that hold BuyEvents in memory and write them out in chunks.
+    Flushes when max_rows or (approximately) max_bytes are buffered, and on flush()/close().
+    Single events and columnar EventBatches can be mixed; subclasses implement _write_items,
+    which receives them in arrival order.
+    """
+
+    def __init__(self, max_rows: int = 10_000, max_bytes: int = 4 * 1024 * 1024):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self._items: list[BuyEvent | EventBatch] = []
+        self._n_rows = 0
+        self._bytes = 0
+
+    def _write_items(self, items: list[BuyEvent | EventBatch]):
+        raise NotImplementedError
+
+    def _added(self, n_rows: int, n_bytes: int):
+        self._n_rows += n_rows
+        self._bytes += n_bytes
+
+        if self._n_rows >= self.max_rows or self._bytes >= self.max_bytes:
+            self.flush()
+
+    def write(self, buy_event: BuyEvent):
+        self._items.append(buy_event)
+        # rough size of one serialized row: numeric columns + the two strings
+        self._added(1, 96 + len(buy_event.symbol) + len(buy_event.reason))
+
+    def write_batch(self, batch: EventBatch):
+        if len(batch) == 0:
+            return
+        self._items.append(batch)
+        self._added(len(batch), 96 * len(batch) + sum(len(r) for r in batch.reasons or ()))
+
+    @timed("sink.flush")
+    def flush(self):
+        if not self._items:
+            return
+        self._write_items(self._items)
+        self._items = []
+        self._n_rows = 0
+        self._bytes = 0
+
+    def close(self):
+        self.flush()
+
+    def _marker(self) -> dict:
+        raise NotImplementedError
+
+    def _rollback(self, marker: dict):
+        raise NotImplementedError
+
+    def checkpoint(self) -> dict:
+        """
+        Flushes and returns a marker of everything written so far, see rollback().
+        """
+        self.flush()
+        return self._marker()
+
+    def rollback(self, marker: dict):
+        """
+        Drops the rows written (or buffered) after checkpoint() returned marker.
+        """
+        self._discard()
+        self._rollback(marker)
+
+    def rotate(self):
+        """
+        Starts a fresh output, keeping the previous run's output aside (see subclasses).
+        """
+        self._discard()
+        self._rotate()
+
+    def _discard(self):
+        self._items = []
+        self._n_rows = 0
+        self._bytes = 0
+
+    def _rotate(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class BufferedCsvBuyWriter(BufferedBuyWriter):
+    """
+    Same file format as CsvBuyWriter, but opens the file once per flush instead of once per event.
+    """
+
+    def __init__(self, path: str, max_rows: int = 10_000, max_bytes: int = 4 * 1024 * 1024):
+        super().__init__(max_rows=max_rows, max_bytes=max_bytes)
+        # creates the file with header if missing
+        self._csv = CsvBuyWriter(path)
+        self.path = self._csv.path
+
+    def _write_items(self, items: list[BuyEvent | EventBatch]):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for item in items:
+            if isinstance(item, EventBatch):
+                writer.writerows(_csv_rows(item))
+            else:
+                writer.writerow(_csv_row(item))
+
+        with self.path.open("a", newline="", encoding="utf-8") as f:
+            f.write(buf.getvalue())
+
+    def _marker(self) -> dict:
+        return self._csv.checkpoint()
+
+    def _rollback(self, marker: dict):
+        self._csv.rollback(marker)
+
+    def _rotate(self):
+        self._csv.rotate()
+
+
+class ParquetBuyWriter(BufferedBuyWriter):
+    """
+    Columnar sink: every flush writes one snappy Parquet part file into a directory, e.g.
+
+      output/buys/
+        part-<utc-ns>-<run_id>-<seq>.parquet
+
+    Read back with pd.read_parquet("output/buys").
+    """
+
+    SCHEMA = pa.schema([
+        ("symbol", pa.string()),
+        ("period_end_date", pa.date32()),
+        ("close_price", pa.float64()),
+        ("intrinsic_value", pa.float64()),
+        ("bps", pa.float64()),
+        ("rnoa", pa.float64()),
+        ("MoS", pa.float64()),
+        ("nrShares", pa.float64()),
+        ("reason", pa.string()),
+    ])
+
+    def __init__(self, path: str, max_rows: int = 100_000, max_bytes: int = 32 * 1024 * 1024):
+        super().__init__(max_rows=max_rows, max_bytes=max_bytes)
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        # part files are tagged with the run and a sequence number, like ParquetRecordStore's
+        self.run_id = uuid.uuid4().hex[:12]
+        self._seq = 0
+
+    def _write_items(self, items: list[BuyEvent | EventBatch]):
+        # group consecutive single events into batches, then write straight from the numpy columns
+        batches, events = [], []
+        for item in items:
+            if isinstance(item, EventBatch):
+                if events:
+                    batches.append(EventBatch.from_buys(events))
+                    events = []
+                batches.append(item)
+            else:
+                events.append(item)
+        if events:
+            batches.append(EventBatch.from_buys(events))
+        batch = batches[0] if len(batches) == 1 else EventBatch.concat(batches)
+
+        # NaN -> null
+        def col(name):
+            values = batch.values[name]
+            return pa.array(values, mask=np.isnan(values), type=pa.float64())
+
+        table = pa.table({
+            "symbol": pa.array(batch.symbol_column(), type=pa.string()),
+            "period_end_date": pa.array(batch.period_end_dates).cast(pa.date32()),
+            "close_price": col("close_price"),
+            "intrinsic_value": col("intrinsic_value"),
+            "bps": col("bps"),
+            "rnoa": col("rnoa"),
+            "MoS": col("mos"),
+            "nrShares": col("nr_shares"),
+            "reason": pa.array(batch.reasons or [""] * len(batch), type=pa.string()),
+        }, schema=self.SCHEMA)
+
+        self._seq += 1
+        pq.write_table(table, self.path / part_filename(self.run_id, self._seq), compression="snappy")
+
+    def _marker(self) -> dict:
+        return {"run": self.run_id, "seq": self._seq}
+
+    def _rollback(self, marker: dict):
+        remove_run_parts(self.path, marker["run"], marker["seq"])
+        self.run_id, self._seq = marker["run"], marker["seq"]
+
+    def _rotate(self):
+        # the previous run's directory is moved to <name>.prev
+        prev = self.path.with_name(self.path.name + ".prev")
+        if prev.exists():
+            shutil.rmtree(prev)
+        self.path.replace(prev)
+        self.path.mkdir(parents=True, exist_ok=True)
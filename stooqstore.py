@@ -0,0 +1,118 @@
+"""
+Converts a Stooq bulk TXT tree into a columnar on-disk price store that
+MmapStooqPriceProvider reads zero-copy via np.memmap:
+
+  out_dir/
+    dates.<gen>.bin     int64 days since 1970-01-01, all symbols back to back
+    closes.<gen>.bin    float64 closes, same layout
+    index.json          {"dates_file": ..., "closes_file": ..., "countries": [...],
+                         "symbols": {"aapl.us": {"us": [start, end]}}}
+
+Every build writes a new generation of bins and then swaps index.json in atomically, so
+a crash leaves the previous index pointing at the previous bins.
+
+Usage:
+  python stooqstore.py stooq_daily_data data/stooq_store
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from priceprovider import StooqManifest
+
+DATE_COL = "<DATE>"
+CLOSE_COL = "<CLOSE>"
+INDEX_VERSION = 2
+
+
+def write_stooq_store(out_dir: Path, histories, countries: list[str]) -> int:
+    """
+    Writes the store from an iterable of (name, country, dates, closes) with dates as datetime64[D].
+    Returns the number of symbols written.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    symbols: dict[str, dict[str, list[int]]] = {}
+    offset = 0
+
+    gen = time.time_ns()
+    dates_file, closes_file = f"dates.{gen}.bin", f"closes.{gen}.bin"
+
+    # new generation files first, the store is swapped in by replacing index.json
+    with open(out_dir / dates_file, "wb") as f_dates, open(out_dir / closes_file, "wb") as f_closes:
+        for name, country, dates, closes in histories:
+            order = np.argsort(dates, kind="mergesort")
+            f_dates.write(dates[order].astype(np.int64).tobytes())
+            f_closes.write(np.asarray(closes, dtype=np.float64)[order].tobytes())
+
+            symbols.setdefault(name, {})[country] = [offset, offset + len(order)]
+            offset += len(order)
+
+        f_dates.flush()
+        f_closes.flush()
+        os.fsync(f_dates.fileno())
+        os.fsync(f_closes.fileno())
+
+    tmp = out_dir / "index.json.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": INDEX_VERSION,
+            "rows": offset,
+            "dates_file": dates_file,
+            "closes_file": closes_file,
+            "countries": sorted(countries),
+            "symbols": symbols,
+        }, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, out_dir / "index.json")
+
+    # previous generations are unreferenced now
+    for f in out_dir.glob("*.bin"):
+        if f.name not in (dates_file, closes_file):
+            f.unlink()
+
+    print(f"✔ Wrote {len(symbols)} symbols / {offset} rows to {out_dir}")
+    return len(symbols)
+
+
+def _read_tree(root: Path, manifest: StooqManifest):
+    for name in sorted(manifest.files):
+        for country, rel in sorted(manifest.files[name].items()):
+            p = root / rel
+            try:
+                df = pd.read_csv(p, usecols=[DATE_COL, CLOSE_COL], dtype={DATE_COL: str})
+            except Exception as e:
+                #some files downloaded from stooq are empty
+                print(f"skipping {p}: {e}")
+                continue
+
+            dates = pd.to_datetime(df[DATE_COL], format="%Y%m%d", errors="raise").to_numpy().astype("datetime64[D]")
+            yield name, country, dates, df[CLOSE_COL].to_numpy(dtype=np.float64)
+
+
+def build_stooq_store(root: Path, out_dir: Path) -> int:
+    """
+    Ingests every file of the tree once (files are resolved through the StooqManifest).
+    Returns the number of symbols written.
+    """
+    root = Path(root)
+    manifest = StooqManifest(root).load()
+    return write_stooq_store(out_dir, _read_tree(root, manifest), manifest.countries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a Stooq bulk TXT tree into a memory-mapped price store")
+    parser.add_argument("root", type=Path, help="e.g. stooq_daily_data")
+    parser.add_argument("out_dir", type=Path, help="e.g. data/stooq_store")
+    args = parser.parse_args()
+
+    build_stooq_store(args.root, args.out_dir)
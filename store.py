@@ -1,9 +1,69 @@
 from __future__ import annotations
 
+import shutil
+import uuid
+from datetime import date
 from pathlib import Path
 from typing import Any, Mapping, Sequence, Optional
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from profiling import timed
+
+
+def part_filename(run_id: str, seq: int) -> str:
+    """
+    part-<utc-ns>-<run_id>-<seq>.parquet: sorts by write time, and names the run and
+    the position within the run that wrote the file.
+    """
+    return f"part-{pd.Timestamp.utcnow().value}-{run_id}-{seq:08d}.parquet"
+
+
+def remove_run_parts(path: Path, run_id: str, seq: int) -> int:
+    """
+    Deletes the part files below path that run run_id wrote after its seq-th file.
+    Files of other runs (and untagged files) are left alone. Returns the number of files removed.
+    """
+    removed = 0
+    for f in Path(path).rglob(f"part-*-{run_id}-*.parquet"):
+        try:
+            written_seq = int(f.stem.rsplit("-", 1)[1])
+        except ValueError:
+            continue
+        if written_seq > seq:
+            f.unlink()
+            removed += 1
+    return removed
+
+
+def unified_schema(files: Sequence[Path], partition_col: str) -> pa.Schema:
+    """
+    One schema over part files that were written record by record and disagree on types:
+    a column that is None in every record of a file (e.g. rnoa) is null-typed in that file,
+    and newer pandas writes strings as large_string. Null columns become float64, large
+    strings strings, and the in-file copy of the partition column is left to the partitioning.
+    Only the file footers are read.
+    """
+    schemas = []
+    for f in files:
+        schemas.append(pa.schema([
+            pa.field(field.name, pa.string() if pa.types.is_large_string(field.type) else field.type)
+            for field in pq.read_schema(f)
+            if field.name != partition_col
+        ]))
+    try:
+        # also widens e.g. int64 + float64 where the records disagree
+        unified = pa.unify_schemas(schemas, promote_options="permissive")
+    except TypeError:
+        # pyarrow < 14: null still unifies with any type
+        unified = pa.unify_schemas(schemas)
+    return pa.schema(
+        [pa.field(f.name, pa.float64() if pa.types.is_null(f.type) else f.type) for f in unified]
+        + [pa.field(partition_col, pa.string())]
+    )
 
 
 class ParquetRecordStore:
@@ -24,38 +84,40 @@ class ParquetRecordStore:
     def __init__(self, root_dir: str = "data"):
         self.root = Path(root_dir)
         self.root.mkdir(parents=True, exist_ok=True)
+        # every part file is tagged with this run and a sequence number, see checkpoint()
+        self.run_id = uuid.uuid4().hex[:12]
+        self._seq = 0
 
-    def append(
-        self,
-        dataset: str,
-        record: Mapping[str, Any],
-        partition_cols: Optional[Sequence[str]] = ("symbol",),
-    ) -> None:
+    def _validate(self, dataset: str, record: Mapping[str, Any]) -> None:
         if not dataset or not isinstance(dataset, str):
                 raise ValueError("dataset must be a non-empty string")
         
         if not isinstance(record, Mapping) or len(record) == 0:
             raise ValueError("record must be a non-empty dict-like mapping")
 
-        df = pd.DataFrame([dict(record)])
-
+    def _partition_path(
+        self,
+        dataset: str,
+        record: Mapping[str, Any],
+        partition_cols: Optional[Sequence[str]],
+    ) -> Path:
         dataset_path = self.root / dataset
-        dataset_path.mkdir(parents=True, exist_ok=True)
 
         # Build partition path like: symbol=MULT.DE/
-        if partition_cols:
-            part_path = dataset_path
-            for col in partition_cols:
-                if col not in df.columns:
-                    raise ValueError(f"partition column '{col}' missing from record")
-                val = df[col].iloc[0]
-                part_path = part_path / f"{col}={val}"
-            part_path.mkdir(parents=True, exist_ok=True)
-        else:
-            part_path = dataset_path
+        part_path = dataset_path
+        for col in partition_cols or ():
+            if col not in record:
+                raise ValueError(f"partition column '{col}' missing from record")
+            part_path = part_path / f"{col}={record[col]}"
+        return part_path
+
+    @timed("store.write_part")
+    def _write_part(self, part_path: Path, df: pd.DataFrame) -> None:
+        part_path.mkdir(parents=True, exist_ok=True)
 
-        # Unique filename per append (safe + simple)
-        filename = f"part-{pd.Timestamp.utcnow().value}.parquet"
+        # Unique filename per write (safe + simple)
+        self._seq += 1
+        filename = part_filename(self.run_id, self._seq)
 
         df.to_parquet(
             part_path / filename,
@@ -64,9 +126,300 @@ class ParquetRecordStore:
             compression="snappy",
         )
 
+    @timed("store.append")
+    def append(
+        self,
+        dataset: str,
+        record: Mapping[str, Any],
+        partition_cols: Optional[Sequence[str]] = ("symbol",),
+    ) -> None:
+        self._validate(dataset, record)
+
+        part_path = self._partition_path(dataset, record, partition_cols)
+        self._write_part(part_path, pd.DataFrame([dict(record)]))
+
     def read(self, dataset: str, filters=None) -> pd.DataFrame:
         dataset_path = self.root / dataset
         print('dataset path: ', dataset_path)
         if not dataset_path.exists():
             raise FileNotFoundError(f"Dataset not found: {dataset_path}")
-        return pd.read_parquet(dataset_path, filters=filters)
\ No newline at end of file
+        return pd.read_parquet(dataset_path, filters=filters)
+
+    def scan(
+        self,
+        dataset: str,
+        symbols: Optional[Sequence[str]] = None,
+        start: date | str | None = None,
+        end: date | str | None = None,
+        columns: Optional[Sequence[str]] = None,
+        date_col: str = "asof_date",
+        partition_col: str = "symbol",
+    ) -> pd.DataFrame:
+        """
+        Reads a dataset through a pyarrow dataset:
+          - symbols: only the matching partition directories are listed and opened
+          - start/end: inclusive range filter on date_col, pushed down to the row groups
+          - columns: projection, only these columns are decoded
+        Result is sorted by date_col when it is part of the output.
+        """
+        dataset_path = self.root / dataset
+        if not dataset_path.exists():
+            raise FileNotFoundError(f"Dataset not found: {dataset_path}")
+
+        partitioning = ds.partitioning(pa.schema([(partition_col, pa.string())]), flavor="hive")
+
+        if symbols is not None:
+            # prune partitions without walking the whole dataset
+            files = [
+                f
+                for symbol in symbols
+                for f in sorted((dataset_path / f"{partition_col}={symbol}").glob("*.parquet"))
+            ]
+        else:
+            files = sorted(dataset_path.rglob("*.parquet"))
+        if not files:
+            return pd.DataFrame(columns=list(columns) if columns else None)
+
+        # explicit schema: the default one is taken from the first file, which uncompacted data breaks
+        dataset_ = ds.dataset(
+            [str(f) for f in files],
+            schema=unified_schema(files, partition_col),
+            format="parquet",
+            partitioning=partitioning,
+            partition_base_dir=str(dataset_path),
+        )
+
+        # dates are stored as ISO strings, so string comparison == date comparison
+        expr = None
+        if start is not None:
+            expr = ds.field(date_col) >= str(start)
+        if end is not None:
+            cond = ds.field(date_col) <= str(end)
+            expr = cond if expr is None else expr & cond
+
+        df = dataset_.to_table(columns=list(columns) if columns else None, filter=expr).to_pandas()
+
+        if date_col in df.columns:
+            df = df.sort_values(date_col, kind="mergesort").reset_index(drop=True)
+        return df
+
+    def read_symbol(self, dataset: str, symbol: str, **kwargs) -> pd.DataFrame:
+        """
+        Time series of one symbol, see scan() for start/end/columns.
+        """
+        return self.scan(dataset, symbols=[symbol], **kwargs)
+
+    def _replace_partition(self, part_path: Path, frames: Sequence[pd.DataFrame]) -> None:
+        """
+        Replaces the files of a partition directory with one part file per frame. The new files
+        are written to a staging directory outside the dataset (root/.staging) and swapped in,
+        so a crash leaves either the old or the new files in the dataset, never both.
+        """
+        staging = self.root / ".staging" / part_path.relative_to(self.root)
+        if staging.exists():
+            shutil.rmtree(staging)
+        for df in frames:
+            self._write_part(staging, df)
+        staging.mkdir(parents=True, exist_ok=True)
+
+        old = staging.with_name(staging.name + ".old")
+        if old.exists():
+            shutil.rmtree(old)
+        part_path.replace(old)
+        staging.replace(part_path)
+        shutil.rmtree(old)
+
+    def compact(self, dataset: str, sort_by: str = "asof_date", rows_per_file: int = 1_000_000) -> int:
+        """
+        Merges the part files of every partition of a dataset into as few files as possible
+        (at most rows_per_file rows each), sorted by sort_by. The partition is swapped for the
+        new files in one step (see _replace_partition). Returns the number of files removed.
+        """
+        dataset_path = self.root / dataset
+        if not dataset_path.exists():
+            raise FileNotFoundError(f"Dataset not found: {dataset_path}")
+
+        partitions: dict[Path, list[Path]] = {}
+        for f in dataset_path.rglob("*.parquet"):
+            partitions.setdefault(f.parent, []).append(f)
+
+        removed = 0
+        for part_path, files in partitions.items():
+            if len(files) <= 1:
+                continue
+
+            # file by file via pandas: tiny files can disagree on inferred types (e.g. all-null columns)
+            df = pd.concat([pd.read_parquet(f) for f in sorted(files)], ignore_index=True)
+            if sort_by in df.columns:
+                df = df.sort_values(sort_by, kind="mergesort").reset_index(drop=True)
+
+            self._replace_partition(part_path, [df.iloc[offset:offset + rows_per_file] for offset in range(0, len(df), rows_per_file)])
+            removed += len(files)
+
+        return removed
+
+    def delete_from(
+        self,
+        dataset: str,
+        cutoffs: Mapping[str, date | str],
+        date_col: str = "period_bucket",
+        partition_col: str = "symbol",
+    ) -> int:
+        """
+        Removes the rows of every symbol in cutoffs whose date_col is >= that symbol's cutoff.
+        The remaining rows of a touched partition are rewritten into one file, swapped in like
+        compact() does. Returns the number of rows removed.
+        """
+        dataset_path = self.root / dataset
+        if not dataset_path.exists():
+            return 0
+
+        removed = 0
+        for symbol, cutoff in cutoffs.items():
+            part_path = dataset_path / f"{partition_col}={symbol}"
+            files = sorted(part_path.glob("*.parquet"))
+            if not files:
+                continue
+
+            df = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+            # dates are stored as ISO strings
+            keep = (df[date_col].astype(str) < str(cutoff)).to_numpy()
+            if keep.all():
+                continue
+
+            self._replace_partition(part_path, [df[keep].reset_index(drop=True)] if keep.any() else [])
+            removed += int((~keep).sum())
+
+        return removed
+
+    def at_boundary(self) -> bool:
+        """
+        Called between groups of records (e.g. periods). Returns True if every record appended
+        so far is on disk, i.e. checkpoint() covers it; an unbuffered store always is.
+        """
+        return True
+
+    def checkpoint(self) -> dict:
+        """
+        Marker of everything written so far, see rollback().
+        """
+        return {"run": self.run_id, "seq": self._seq}
+
+    def rollback(self, marker: dict) -> int:
+        """
+        Removes the part files the checkpointed run wrote after checkpoint() returned marker,
+        in every dataset, and continues that run: later files are tagged with its run id.
+        Returns the number of files removed.
+        """
+        removed = remove_run_parts(self.root, marker["run"], marker["seq"])
+        self.run_id, self._seq = marker["run"], marker["seq"]
+        return removed
+
+    def rotate(self, dataset: str) -> None:
+        """
+        Moves a dataset aside to <dataset>.prev (replacing an older one), so a fresh run
+        starts from an empty dataset instead of appending a second copy.
+        """
+        dataset_path = self.root / dataset
+        if not dataset_path.exists():
+            return
+        prev = dataset_path.with_name(dataset_path.name + ".prev")
+        if prev.exists():
+            shutil.rmtree(prev)
+        dataset_path.replace(prev)
+
+
+class BufferedParquetRecordStore(ParquetRecordStore):
+    """
+    ParquetRecordStore that accumulates records per (dataset, partition) and writes one
+    part file per partition on flush, instead of one file per record.
+
+    A partition is flushed as soon as it holds rows_per_file records; everything is flushed
+    when max_buffered_rows records are pending in total, on flush() and on close().
+    Use it as a context manager so nothing is lost on exit:
+
+      with BufferedParquetRecordStore("data") as store:
+          ...
+
+    With flush_at_boundaries=True the max_buffered_rows flush waits for the next at_boundary()
+    call (at most one group of records more in memory), so every full flush ends a group and a
+    checkpoint can be taken there without flushing small files early.
+    """
+
+    def __init__(self, root_dir: str = "data", rows_per_file: int = 50_000, max_buffered_rows: int = 200_000,
+                 flush_at_boundaries: bool = False):
+        super().__init__(root_dir)
+        self.rows_per_file = rows_per_file
+        self.max_buffered_rows = max_buffered_rows
+        self.flush_at_boundaries = flush_at_boundaries
+        self._buffers: dict[Path, list[dict]] = {}   # partition path -> pending records
+        self._pending = 0
+
+    @timed("store.append")
+    def append(
+        self,
+        dataset: str,
+        record: Mapping[str, Any],
+        partition_cols: Optional[Sequence[str]] = ("symbol",),
+    ) -> None:
+        self._validate(dataset, record)
+
+        part_path = self._partition_path(dataset, record, partition_cols)
+        rows = self._buffers.setdefault(part_path, [])
+        rows.append(dict(record))
+        self._pending += 1
+
+        if len(rows) >= self.rows_per_file:
+            self._flush_partition(part_path)
+        elif self._pending >= self.max_buffered_rows and not self.flush_at_boundaries:
+            self.flush()
+
+    def _flush_partition(self, part_path: Path) -> None:
+        rows = self._buffers.pop(part_path, None)
+        if not rows:
+            return
+        self._write_part(part_path, pd.DataFrame(rows))
+        self._pending -= len(rows)
+
+    def flush(self) -> None:
+        for part_path in list(self._buffers):
+            self._flush_partition(part_path)
+
+    def close(self) -> None:
+        self.flush()
+
+    def at_boundary(self) -> bool:
+        if self._pending >= self.max_buffered_rows:
+            self.flush()
+        return self._pending == 0
+
+    def checkpoint(self) -> dict:
+        # flushing here would write one small file per partition; checkpoint at a boundary instead
+        if self._pending:
+            raise RuntimeError(f"{self._pending} records are still buffered; checkpoint after flush() or when at_boundary() is True")
+        return super().checkpoint()
+
+    def rollback(self, marker: dict) -> int:
+        # pending records were not part of the checkpoint either
+        self._buffers = {}
+        self._pending = 0
+        return super().rollback(marker)
+
+    def rotate(self, dataset: str) -> None:
+        self.flush()
+        super().rotate(dataset)
+
+    def read(self, dataset: str, filters=None) -> pd.DataFrame:
+        # make pending records visible to readers
+        self.flush()
+        return super().read(dataset, filters=filters)
+
+    def delete_from(self, dataset: str, cutoffs: Mapping[str, date | str], **kwargs) -> int:
+        self.flush()
+        return super().delete_from(dataset, cutoffs, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
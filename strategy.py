@@ -2,9 +2,9 @@ from __future__ import annotations
 
 from abc import ABC, abstractmethod
 from sqlalchemy.engine import Engine
-from sqlalchemy import text
 
-from events import MarketEvent, BuyEvent
+from dataaccess import DataAccess
+from events import MarketEvent, BuyEvent, EventBatch
 
 
 class Strategy(ABC):
@@ -14,7 +14,68 @@ class Strategy(ABC):
 
     def __init__(self, engine: Engine):
         self.engine = engine
+        # one connection per run, lookups coalesced per period (see DataAccess)
+        self.db = DataAccess(engine)
+
+    def on_start(self, symbols: list[str]) -> None:
+        """
+        Optional hook, called by the engine with the full universe before the event loop starts.
+        """
+        pass
+
+    def begin_period(self, events: EventBatch) -> None:
+        """
+        Called by the engine with all events of a period_end_date before they are dispatched.
+        Tells the data access layer which symbols to fetch together.
+        """
+        self.db.begin_period(events.symbol_column().tolist())
+
+    def on_finish(self) -> None:
+        """
+        Hook called by the engine when the run ends (also after an error), before the sink is closed.
+        Overrides should call super().on_finish().
+        """
+        if self.db.lookups:
+            print(f"data access: {self.db.lookups} lookups served by {self.db.queries} queries")
+        self.db.close()
+
+    def checkpoint_state(self, force: bool = False) -> dict | None:
+        """
+        Optional hook: JSON-serializable state to persist with an engine checkpoint.
+        Called at period boundaries, after the period's buys have been written. May return None
+        if there is no cheap consistent state right now (e.g. records still buffered); the engine
+        then tries again after the next period. With force=True (start and end of a run) a
+        state must be returned.
+        """
+        return {}
+
+    def restore_state(self, state: dict) -> None:
+        """
+        Optional hook: called with the checkpoint_state() of the last checkpoint when a run resumes,
+        before on_start. Must undo anything written after that checkpoint.
+        """
+        pass
+
+    def reset_state(self) -> None:
+        """
+        Optional hook: called instead of restore_state() when a checkpointed run starts fresh,
+        before on_start. Must move aside the output of previous runs, like the engine rotates the sink.
+        """
+        pass
 
     @abstractmethod
     def on_market(self, event: MarketEvent) -> BuyEvent | None:
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def on_market_batch(self, events: EventBatch | list[MarketEvent]) -> list[BuyEvent] | EventBatch:
+        """
+        Optional hook for batched dispatch: receives all events of one period_end_date
+        (an EventBatch, which iterates as MarketEvents). Override to resolve a whole cross-section
+        at once; by default falls back to on_market per event.
+        """
+        buys = []
+        for event in events:
+            buy = self.on_market(event)
+            if buy is not None:
+                buys.append(buy)
+        return buys
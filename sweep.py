@@ -0,0 +1,173 @@
+"""
+Parameter sweep of PenmanTTMAsOfStrategy: config independent inputs are collected once,
+then every PenmanConfig of a grid is evaluated vectorized. One csv of buy signals per config.
+
+Usage:
+  python sweep.py --wacc 0.08 0.10 0.12 --tax-rate 0.3 --mos 0.5 0.7 --out output/sweep
+"""
+from __future__ import annotations
+
+import argparse
+from dataclasses import asdict
+from itertools import product
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data import PostgresDataHandler
+from fundamentals import PenmanTTMFundamentals, penman_value
+from PenmanTTMStrategy import PenmanConfig
+
+CONFIG_COLS = ["wacc", "tax_rate", "margin_of_safety", "min_price"]
+
+
+def config_grid(
+    wacc: list[float],
+    tax_rate: list[float],
+    margin_of_safety: list[float],
+    min_price: list[float] = (PenmanConfig.min_price,),
+) -> list[PenmanConfig]:
+    """
+    Cartesian product of the given values, e.g. config_grid([0.08, 0.10], [0.3], [0.5, 0.7]).
+    """
+    return [PenmanConfig(wacc=w, tax_rate=t, margin_of_safety=m, min_price=p) for w, t, m, p in product(wacc, tax_rate, margin_of_safety, min_price)]
+
+
+def collect_penman_inputs(data: PostgresDataHandler, prices, fundamentals: PenmanTTMFundamentals) -> pd.DataFrame:
+    """
+    Everything of a Penman run that does not depend on PenmanConfig, fetched once:
+    one row per market event with a close and a valid last-4-quarters window, in stream order.
+    """
+    rows = []
+    for symbol, ped in data.stream():
+        asof_date, close = prices.last_close_in_month(symbol, ped)
+        if close is None:
+            continue
+
+        if not fundamentals.has_valid_last4_quarters(symbol, asof_date):
+            continue
+
+        x = fundamentals.inputs(symbol, asof_date)
+        if x is None:
+            continue
+
+        rows.append({"symbol": symbol, "period_bucket": ped, "asof_date": asof_date, "close": close, **x})
+
+    return pd.DataFrame(rows, columns=["symbol", "period_bucket", "asof_date", "close", "sustainable_ebit", "shares_diluted", "avg_noa", "b0"])
+
+
+def sweep_penman(inputs: pd.DataFrame, configs: list[PenmanConfig], chunk_size: int = 64) -> pd.DataFrame:
+    """
+    Evaluates the closed-form Penman value and the buy rule of PenmanTTMAsOfStrategy for every
+    config at once, as (configs x events) arrays. Configs are processed chunk_size at a time to
+    bound memory. Returns the buy signals with the BuyEvent columns plus config_id and the config values.
+    """
+    columns = ["config_id", *CONFIG_COLS, "symbol", "period_end_date", "close_price", "intrinsic_value", "bps", "rnoa", "MoS", "nrShares"]
+    if inputs.empty or not configs:
+        return pd.DataFrame(columns=columns)
+
+    close = inputs["close"].to_numpy(dtype=float)[None, :]
+    ebit = inputs["sustainable_ebit"].to_numpy(dtype=float)[None, :]
+    avg_noa = inputs["avg_noa"].to_numpy(dtype=float)[None, :]
+    b0 = inputs["b0"].to_numpy(dtype=float)[None, :]
+    shares = inputs["shares_diluted"].to_numpy(dtype=float)[None, :]
+
+    cfg = pd.DataFrame([asdict(c) for c in configs])[CONFIG_COLS]
+
+    parts = []
+    for start in range(0, len(configs), chunk_size):
+        c = cfg.iloc[start:start + chunk_size]
+        wacc, tax_rate, mos, min_price = (c[col].to_numpy(dtype=float)[:, None] for col in CONFIG_COLS)
+
+        val = penman_value(ebit, avg_noa, b0, shares, tax_rate, wacc)
+        value = val["equity_val_per_share"]
+
+        # same rule as on_market: close >= min_price, value > 0, value >= close * (1 + MOS)
+        with np.errstate(invalid="ignore"):
+            buy = (close >= min_price) & (value > 0) & (value >= close * (1.0 + mos))
+
+        cfg_i, ev_i = np.nonzero(buy)
+        if len(ev_i) == 0:
+            continue
+
+        v = value[cfg_i, ev_i]
+        px = close[0, ev_i]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            part = pd.DataFrame({
+                "config_id": start + cfg_i,
+                "wacc": wacc[cfg_i, 0],
+                "tax_rate": tax_rate[cfg_i, 0],
+                "margin_of_safety": mos[cfg_i, 0],
+                "min_price": min_price[cfg_i, 0],
+                "symbol": inputs["symbol"].to_numpy()[ev_i],
+                "period_end_date": inputs["asof_date"].to_numpy()[ev_i],
+                "close_price": px,
+                "intrinsic_value": v,
+                "bps": b0[0, ev_i] / shares[0, ev_i],
+                "rnoa": np.broadcast_to(val["rnoa"], value.shape)[cfg_i, ev_i],
+                "MoS": (v - px) / v,
+                "nrShares": shares[0, ev_i],
+            })
+        parts.append(part)
+
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts, ignore_index=True)[columns]
+
+
+def write_signal_sets(signals: pd.DataFrame, configs: list[PenmanConfig], out_dir: str = "output/sweep") -> list[Path]:
+    """
+    One csv per config, named after the config values, e.g. buys_wacc=0.1_tax=0.3_mos=0.7_minp=0.01.csv.
+    Configs without signals get a file with just the header, so "no signals" is distinguishable from "not run".
+    """
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+
+    groups = dict(tuple(signals.groupby("config_id", sort=True)))
+
+    paths = []
+    for config_id, cfg in enumerate(configs):
+        name = f"buys_wacc={cfg.wacc:g}_tax={cfg.tax_rate:g}_mos={cfg.margin_of_safety:g}_minp={cfg.min_price:g}.csv"
+        groups.get(config_id, signals.iloc[0:0]).to_csv(out / name, index=False)
+        paths.append(out / name)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a grid of PenmanConfigs in one pass")
+    parser.add_argument("--wacc", type=float, nargs="+", default=[PenmanConfig.wacc])
+    parser.add_argument("--tax-rate", type=float, nargs="+", default=[PenmanConfig.tax_rate])
+    parser.add_argument("--mos", type=float, nargs="+", default=[PenmanConfig.margin_of_safety], help="margins of safety")
+    parser.add_argument("--min-price", type=float, nargs="+", default=[PenmanConfig.min_price])
+    parser.add_argument("--chunk-size", type=int, default=64, help="configs evaluated per array pass")
+    parser.add_argument("--out", default="output/sweep")
+    args = parser.parse_args()
+
+    # same universe, prices and fundamentals as main.py
+    from sqlalchemy import create_engine
+    from extract_tickers import extractTickers
+    from main import db_url_from_env
+    from pricecache import PriceCache
+    from priceprovider import EODHDPriceProvider
+    from symbolresolver import SymbolResolver
+
+    configs = config_grid(args.wacc, args.tax_rate, args.mos, args.min_price)
+    print(f"sweeping {len(configs)} configs")
+
+    db_url = db_url_from_env()
+    engine = create_engine(db_url, future=True)
+    symbols = extractTickers()
+
+    prices = EODHDPriceProvider(engine, cache=PriceCache("data/price_cache"), resolver=SymbolResolver(engine).load(symbols))
+    prices.prefetch(symbols)
+    fundamentals = PenmanTTMFundamentals(engine, symbols).load()
+
+    inputs = collect_penman_inputs(PostgresDataHandler(db_url, symbols), prices, fundamentals)
+    signals = sweep_penman(inputs, configs, chunk_size=args.chunk_size)
+    paths = write_signal_sets(signals, configs, args.out)
+    print(f"✔ Wrote {len(signals)} signals of {len(configs)} configs to {len(paths)} files in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from helpers import EXCHANGE_MAPPING
+
+
+def eodhd_candidates(qfs_symbol: str, exchange: str | None) -> list[str] | None:
+    """
+    EODHD tickers to try for a qfs symbol, e.g. VOD:LN on London -> ["VOD.LSE", "VOD.IL"].
+    None if the symbol has no country code or country$exchange is not in EXCHANGE_MAPPING.
+    """
+    if ":" not in qfs_symbol:
+        return None
+
+    ticker, country_code = qfs_symbol.split(":", 1)
+    exchanges = EXCHANGE_MAPPING.get(f"{country_code}${exchange}")
+    if exchanges is None:
+        return None
+    return [f"{ticker}.{exchg}" for exchg in exchanges]
+
+
+class SymbolResolver:
+    """
+    Resolves qfs symbols to their exchange and EODHD candidate tickers with dictionary lookups.
+
+    The quickfs_dj_tradedcompanies mapping is loaded for the whole universe in one query and
+    persisted as JSON, so later runs (backtest and post-processing) need no DB round-trips
+    for symbols that were resolved before. Symbols not found in the table are remembered for
+    negative_ttl only, so newly listed symbols or a failed lookup get retried:
+
+      {"exchanges": {"VOD:LN": "London", ...}, "missing": {"FOO:US": <unix time of the lookup>, ...}}
+    """
+
+    SQL = text("""
+        SELECT qfs_symbol, exchange
+        FROM quickfs_dj_tradedcompanies
+        WHERE qfs_symbol = ANY(:symbols)
+    """)
+
+    def __init__(self, engine: Engine | None = None, path: str | Path = "output/symbol_resolution.json",
+                 negative_ttl: timedelta = timedelta(days=1)):
+        self.engine = engine
+        self.path = Path(path)
+        self.negative_ttl = negative_ttl
+        self._exchanges: dict[str, str | None] = {}              # qfs symbol -> exchange (None: not in table)
+        self._candidates: dict[str, list[str] | None] = {}       # qfs symbol -> eodhd candidates
+        self._missing_since: dict[str, float] = {}               # qfs symbol -> time it was not found
+
+        if self.path.exists():
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+
+            # files of the old flat format {symbol: exchange | None} keep only the hits
+            if "exchanges" not in data:
+                data = {"exchanges": {s: e for s, e in data.items() if e is not None}, "missing": {}}
+
+            cutoff = time.time() - self.negative_ttl.total_seconds()
+            missing = {s: t for s, t in data["missing"].items() if t >= cutoff}
+            self._missing_since.update(missing)
+            self._set({**data["exchanges"], **dict.fromkeys(missing)})
+
+    def _set(self, exchanges: dict[str, str | None]) -> None:
+        self._exchanges.update(exchanges)
+        # candidates are derived from the current EXCHANGE_MAPPING, not persisted
+        for symbol, exchange in exchanges.items():
+            self._candidates[symbol] = eodhd_candidates(symbol, exchange)
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump({
+                "exchanges": {s: e for s, e in self._exchanges.items() if e is not None},
+                "missing": {s: self._missing_since[s] for s, e in self._exchanges.items() if e is None},
+            }, f, indent=0, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def load(self, symbols: list[str], refresh: bool = False) -> "SymbolResolver":
+        """
+        Resolves all symbols not known yet (or all of them with refresh=True) in one query.
+        """
+        todo = list(dict.fromkeys(symbols)) if refresh else [s for s in dict.fromkeys(symbols) if s not in self._exchanges]
+        if not todo:
+            return self
+
+        if self.engine is None:
+            raise RuntimeError(f"{len(todo)} symbols are not resolved yet and no engine was given")
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(self.SQL, {"symbols": todo}).all()
+
+        found = {symbol: None for symbol in todo}
+        found.update({row.qfs_symbol: row.exchange for row in rows})
+
+        now = time.time()
+        for symbol, exchange in found.items():
+            if exchange is None:
+                self._missing_since[symbol] = now
+            else:
+                self._missing_since.pop(symbol, None)
+        self._set(found)
+        self._save()
+
+        print(f"✔ Resolved {len(todo)} symbols ({len(rows)} found in quickfs_dj_tradedcompanies)")
+        return self
+
+    def knows(self, qfs_symbol: str) -> bool:
+        return qfs_symbol in self._exchanges
+
+    def exchange(self, qfs_symbol: str) -> str | None:
+        return self._exchanges.get(qfs_symbol)
+
+    def candidates(self, qfs_symbol: str) -> list[str] | None:
+        return self._candidates.get(qfs_symbol)
@@ -1,27 +1,18 @@
 import pandas as pd
 from pathlib import Path
 import matplotlib.pyplot as plt
+from store import ParquetRecordStore
 
 SYMBOL = "XPEL:US"
 
 
 def read_symbol_safe(root="data", dataset="valuations_penman_ttm", symbol="WLDN:US"):
-    path = Path(root) / dataset / f"symbol={symbol}"
-    files = sorted(path.glob("*.parquet"))
+    #only the symbol's partition is opened; result comes back sorted by asof_date
+    df = ParquetRecordStore(root_dir=root).read_symbol(dataset, symbol)
 
-    if not files:
-        raise FileNotFoundError(f"No parquet files found in {path}")
+    if df.empty:
+        raise FileNotFoundError(f"No parquet files found in {Path(root) / dataset / f'symbol={symbol}'}")
 
-    dfs = []
-    for f in files:
-        df_part = pd.read_parquet(f)
-        dfs.append(df_part)
-
-    df = pd.concat(dfs, ignore_index=True)
-
-    # optional: ensure proper sorting + add symbol back
-    if "asof_date" in df.columns:
-        df = df.sort_values("asof_date")
     df["symbol"] = symbol
     return df
 
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import pickle
+import sqlite3
+from dataclasses import asdict
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from fundamentals import PenmanTTMFundamentals
+from incremental import quarter_fingerprints
+from profiling import timed
+
+# config fields the valuation row depends on (margin_of_safety/min_price only affect the buy rule)
+VALUATION_CONFIG_FIELDS = ("tax_rate", "wacc")
+
+# quarter rows the valuation reads as-of a date: last 4 IS rows, last 8 BS rows
+WINDOWS = {
+    "quickfs_dj_incomestatementquarter": 4,
+    "quickfs_dj_balancesheetquarter": 8,
+}
+
+# odd multipliers for mixing 64 bit hashes (arithmetic wraps around in uint64)
+_MIX_DATE = np.uint64(0x9E3779B97F4A7C15)
+_MIX_ROW = np.uint64(0xC2B2AE3D27D4EB4F)
+
+
+def config_hash(cfg) -> str:
+    values = {k: v for k, v in asdict(cfg).items() if k in VALUATION_CONFIG_FIELDS}
+    return hashlib.sha1(json.dumps(values, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class QuarterFingerprints:
+    """
+    Fingerprint of the quarter rows a valuation as-of (symbol, asof_date) reads.
+
+    Row fingerprints (see incremental.quarter_fingerprints) are loaded once for the universe;
+    for every row the hashes of the window ending at it (incl. dates) are mixed into one value,
+    so a lookup is a searchsorted on the symbol's quarter dates, like PenmanTTMFundamentals.
+    Row fingerprints already read for the incremental snapshot can be passed as rows.
+    """
+
+    def __init__(self, engine, symbols: list[str] | None, rows: pd.DataFrame | None = None):
+        self.engine = engine
+        self.symbols = symbols
+        self.rows = rows
+        self._tables: dict[str, tuple[dict, np.ndarray, np.ndarray]] = {}   # table -> (slices, dates, window fp)
+        self.loaded = False
+
+    @timed("fingerprints.load")
+    def load(self) -> "QuarterFingerprints":
+        fps = self.rows if self.rows is not None else quarter_fingerprints(self.engine, self.symbols)
+
+        for table, window in WINDOWS.items():
+            df = fps[fps["table"] == table].sort_values(["qfs_symbol_id", "period_end_date"], kind="mergesort").reset_index(drop=True)
+            slices, pos = PenmanTTMFundamentals._slices(df["qfs_symbol_id"])
+
+            dates = df["period_end_date"].to_numpy().astype("datetime64[D]")
+            row_fp = df["fp"].to_numpy(dtype=np.int64).view(np.uint64) ^ (dates.astype(np.int64).view(np.uint64) * _MIX_DATE)
+
+            # rows missing from a short history contribute 0
+            window_fp = np.zeros(len(row_fp), dtype=np.uint64)
+            for k in range(window):
+                lagged = np.zeros(len(row_fp), dtype=np.uint64)
+                if k < len(row_fp):
+                    lagged[k:] = row_fp[:len(row_fp) - k]
+                lagged[pos < k] = 0
+                window_fp = window_fp * _MIX_ROW + lagged
+
+            self._tables[table] = (slices, dates, window_fp)
+
+        self.loaded = True
+        return self
+
+    def fingerprint(self, symbol: str, asof: date) -> str:
+        if not self.loaded:
+            self.load()
+
+        parts = []
+        for table in WINDOWS:
+            slices, dates, window_fp = self._tables[table]
+            bounds = slices.get(symbol)
+            k = 0
+            if bounds is not None:
+                start, end = bounds
+                k = int(np.searchsorted(dates[start:end], np.datetime64(asof, "D"), side="right"))
+            parts.append("-" if k == 0 else f"{int(window_fp[start + k - 1]):016x}")
+        return ".".join(parts)
+
+
+def shard_path(path: str | Path, worker: int) -> Path:
+    """
+    Cache file parallel worker number worker writes its new entries to, next to path.
+    """
+    path = Path(path)
+    return path.with_name(f"{path.stem}.worker{worker}{path.suffix}")
+
+
+def _init_db(conn: sqlite3.Connection) -> None:
+    # rollback journal, not WAL: workers open the shared file read-only, which WAL does not allow without its -shm file
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS valuations (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            last_used INTEGER NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_valuations_last_used ON valuations (last_used)")
+    # LRU touches of entries of the shared file, only used in worker shards (see merge_shards)
+    conn.execute("CREATE TABLE IF NOT EXISTS touched (key TEXT PRIMARY KEY, last_used INTEGER NOT NULL)")
+
+
+def _evict(conn: sqlite3.Connection, max_entries: int) -> int:
+    """
+    Deletes the least recently used entries down to 90% of max_entries (so eviction does not
+    run on every commit) once there are more than max_entries. Returns the number deleted.
+    """
+    count = conn.execute("SELECT COUNT(*) FROM valuations").fetchone()[0]
+    if count <= max_entries:
+        return 0
+    n = count - int(max_entries * 0.9)
+    conn.execute(
+        "DELETE FROM valuations WHERE key IN (SELECT key FROM valuations ORDER BY last_used ASC LIMIT ?)",
+        (n,),
+    )
+    return n
+
+
+def merge_shards(path: str | Path = "data/valuation_cache.sqlite", max_entries: int = 1_000_000) -> int:
+    """
+    Folds the worker shards of a parallel run (see ValuationCache) into the shared cache file
+    and removes them. Run it in the parent once the workers are done. Returns the number of
+    entries merged.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    try:
+        _init_db(conn)
+        merged = 0
+        for shard in sorted(path.parent.glob(f"{path.stem}.worker*{path.suffix}")):
+            conn.execute("ATTACH DATABASE ? AS shard", (str(shard),))
+            merged += conn.execute(
+                "INSERT OR REPLACE INTO valuations (key, value, last_used) SELECT key, value, last_used FROM shard.valuations"
+            ).rowcount
+            conn.execute("""
+                UPDATE valuations SET last_used = (SELECT t.last_used FROM shard.touched t WHERE t.key = valuations.key)
+                WHERE key IN (SELECT key FROM shard.touched)
+            """)
+            conn.commit()
+            conn.execute("DETACH DATABASE shard")
+            shard.unlink()
+        _evict(conn, max_entries)
+        conn.commit()
+    finally:
+        conn.close()
+    return merged
+
+
+class ValuationCache:
+    """
+    Persistent valuation results (SQLite), content-addressed by
+    (symbol, asof_date, config hash, fingerprint of the quarter rows read).
+
+    A changed quarter row changes the key, so stale entries are never served; they age out
+    through the LRU eviction once the cache holds more than max_entries rows. A cached value
+    is the valuation row or None (no row / last four quarters not valid).
+
+    Writes (new entries and the LRU touches of hits, which are kept in memory) go to disk on
+    commit(), once per period. Inside a parallel worker (worker = shard index) the shared file
+    is only read; new entries and touches go to the worker's own shard file, which the parent
+    folds into the shared file with merge_shards(), so processes never write the same file.
+    """
+
+    def __init__(self, path: str = "data/valuation_cache.sqlite", fingerprints: QuarterFingerprints | None = None,
+                 max_entries: int = 1_000_000, worker: int | None = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fingerprints = fingerprints
+        self.max_entries = max_entries
+        self.worker = worker
+
+        if worker is None:
+            self.conn = sqlite3.connect(self.path, timeout=30)
+            _init_db(self.conn)
+            self._tables = ["valuations"]
+        else:
+            self.conn = sqlite3.connect(shard_path(self.path, worker), timeout=30, uri=True)
+            _init_db(self.conn)
+            self._tables = ["valuations"]
+            if self.path.exists():
+                self.conn.execute("ATTACH DATABASE ? AS shared", (f"file:{self.path.resolve()}?mode=ro",))
+                self._tables.append("shared.valuations")
+        self.conn.commit()
+
+        self._count, self._tick = self.conn.execute("SELECT COUNT(*), COALESCE(MAX(last_used), 0) FROM valuations").fetchone()
+        if "shared.valuations" in self._tables:
+            self._tick = max(self._tick, self.conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM shared.valuations").fetchone()[0])
+        self._touched: dict[str, int] = {}   # key -> last_used of hits since the last commit
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, symbol: str, asof: date, cfg) -> str:
+        raw = f"{symbol}|{asof.isoformat()}|{config_hash(cfg)}|{self.fingerprints.fingerprint(symbol, asof)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @timed("valuation_cache.get")
+    def get(self, key: str) -> tuple[bool, dict | None]:
+        """
+        (True, value) on a hit, (False, None) on a miss.
+        """
+        row = None
+        for table in self._tables:
+            row = self.conn.execute(f"SELECT value FROM {table} WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                break
+        if row is None:
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        self._tick += 1
+        self._touched[key] = self._tick
+        return True, pickle.loads(row[0])
+
+    @timed("valuation_cache.put")
+    def put(self, key: str, value) -> None:
+        self._tick += 1
+        # pickle keeps the exact types of the row (e.g. Decimal from numeric columns)
+        value = None if value is None else dict(value)
+        cur = self.conn.execute(
+            "INSERT OR REPLACE INTO valuations (key, value, last_used) VALUES (?, ?, ?)",
+            (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), self._tick),
+        )
+        self._count += cur.rowcount
+
+    @timed("valuation_cache.commit")
+    def commit(self) -> None:
+        """
+        Writes the pending LRU touches, evicts if needed and commits.
+        """
+        touched = [(tick, key) for key, tick in self._touched.items()]
+        self._touched = {}
+        self.conn.executemany("UPDATE valuations SET last_used = ? WHERE key = ?", touched)
+        if self.worker is not None:
+            # touches of entries in the shared file, applied by merge_shards
+            self.conn.executemany("INSERT OR REPLACE INTO touched (last_used, key) VALUES (?, ?)", touched)
+        elif self._count > self.max_entries:
+            self.evictions += _evict(self.conn, self.max_entries)
+            self._count = self.conn.execute("SELECT COUNT(*) FROM valuations").fetchone()[0]
+        self.conn.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": self._count,
+        }
+
+    def report(self) -> str:
+        s = self.stats()
+        where = self.path if self.worker is None else shard_path(self.path, self.worker)
+        return (
+            f"valuation cache: {s['hits']} hits, {s['misses']} misses ({s['hit_rate']:.1%} hit rate), "
+            f"{s['evictions']} evicted, {s['entries']} entries in {where}"
+        )
+
+    def close(self) -> None:
+        self.commit()
+        self.conn.close()